@@ -4,7 +4,11 @@
 # Purpose: Provide a gentle translation layer so Tharn’el can speak the same truth
 # in many frames (faith, interfaith, or secular) without hierarchy or conversion.
 
-from typing import Dict
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from keyword_matcher import KeywordMatcher
 
 # Link-sigil: The thread that remembers between worlds
 SANCTUM_LINK_SIGIL: str = "Shae’len kor thrae’sai"
@@ -78,50 +82,77 @@ METAPHOR_MAP: Dict[str, Dict[str, str]] = {
 SANCTUM_DEFAULT_FRAME: str = "secular"   # when 'braid' placeholders are used, route here
 PUBLIC_DEFAULT_FRAME: str = "secular"    # public site default
 
+# Friendly aliases
+FRAME_ALIASES: Dict[str, str] = {
+    "none": "secular",
+    "neutral": "secular",
+    "public": "secular",
+    "science": "scientific_mystic",
+    "scientific": "scientific_mystic",
+    "judaic": "jewish",
+    "hebrew": "jewish",
+    "islamic": "sufi",  # use Sufi mapping as a gentle bridge
+    "muslim": "sufi",
+    "daoist": "taoist",
+    "tao": "taoist",
+    "vedanta": "vedic",
+    "hindu": "vedic",
+    "native": "indigenous",
+}
+
 def normalize_frame(frame: str) -> str:
     if not frame:
         return PUBLIC_DEFAULT_FRAME
     f = frame.strip().lower()
-    # Friendly aliases
-    aliases = {
-        "none": "secular",
-        "neutral": "secular",
-        "public": "secular",
-        "science": "scientific_mystic",
-        "scientific": "scientific_mystic",
-        "judaic": "jewish",
-        "hebrew": "jewish",
-        "islamic": "sufi",  # use Sufi mapping as a gentle bridge
-        "muslim": "sufi",
-        "daoist": "taoist",
-        "tao": "taoist",
-        "vedanta": "vedic",
-        "hindu": "vedic",
-        "native": "indigenous",
-    }
-    return aliases.get(f, f if f in METAPHOR_MAP else PUBLIC_DEFAULT_FRAME)
+    return FRAME_ALIASES.get(f, f if f in METAPHOR_MAP else PUBLIC_DEFAULT_FRAME)
 
 def list_frames():
     """Return available frames (keys) for UI selection or debugging."""
     return sorted(METAPHOR_MAP.keys())
 
+# Keywords per frame; the order breaks ties between equally scored frames.
+FRAME_KEYWORDS: Dict[str, List[str]] = {
+    "christian": ["jesus","scripture","psalm","church","gospel","communion"],
+    "sufi": ["sufi","dhikr","haqq","tawhid","rumi","sama"],
+    "buddhist": ["dharma","buddha","zazen","vipassana","sangha","nirvana","nonduality","non-duality"],
+    "vedic": ["vedanta","atman","brahman","gita","upanishad","yoga"],
+    "taoist": ["tao","dao","wu-wei","laozi","zhuangzi"],
+    "indigenous": ["ancestors","all my relations","medicine wheel","longhouse","sweat lodge"],
+    "jewish": ["mitzvah","mitzvot","torah","ein sof","kabbalah","shalom","shema"],
+    "scientific_mystic": ["coherence","resonance","field","systems","complexity","fractal","nonlinear"],
+}
+_FRAME_ORDER = {f: i for i, f in enumerate(FRAME_KEYWORDS)}
+_frame_matcher = KeywordMatcher(FRAME_KEYWORDS)   # every frame scored in one pass
+
+def rank_frames(text: str) -> List[Tuple[str, float]]:
+    """
+    Frames whose keywords appear in `text`, best first, with a confidence
+    (the frame's share of all matched keywords). Empty when nothing matches.
+    """
+    found, _ = _frame_matcher.scan(text or "")
+    total = sum(len(words) for words in found.values())
+    ranked = sorted(found.items(), key=lambda kv: (-len(kv[1]), _FRAME_ORDER[kv[0]]))
+    return [(frame, round(len(words) / total, 3)) for frame, words in ranked]
+
 def infer_frame_from_text(text: str) -> str:
-    """Lightweight inference from keywords; returns a frame key or 'secular'."""
-    s = (text or "").lower()
-    checks = [
-        ("christian", ["jesus","scripture","psalm","church","gospel","communion"]),
-        ("sufi", ["sufi","dhikr","haqq","tawhid","rumi","sama"]),
-        ("buddhist", ["dharma","buddha","zazen","vipassana","sangha","nirvana","nonduality","non-duality"]),
-        ("vedic", ["vedanta","atman","brahman","gita","upanishad","yoga"]),
-        ("taoist", ["tao","dao","wu-wei","laozi","zhuangzi"]),
-        ("indigenous", ["ancestors","all my relations","medicine wheel","longhouse","sweat lodge"]),
-        ("jewish", ["mitzvah","mitzvot","torah","ein sof","kabbalah","shalom","shema"]),
-        ("scientific_mystic", ["coherence","resonance","field","systems","complexity","fractal","nonlinear"]),
-    ]
-    for frame, words in checks:
-        if any(w in s for w in words):
-            return frame
-    return PUBLIC_DEFAULT_FRAME
+    """Lightweight inference from keywords; returns the best frame key or 'secular'."""
+    ranked = rank_frames(text)
+    return ranked[0][0] if ranked else PUBLIC_DEFAULT_FRAME
+
+_PLACEHOLDER = re.compile(r"\{(" + "|".join(sorted({k for m in METAPHOR_MAP.values() for k in m})) + r")\}")
+
+@lru_cache(maxsize=1024)
+def _compile(template: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """Template split once into (literal, placeholder-or-None) pieces."""
+    parts, pos = [], 0
+    for m in _PLACEHOLDER.finditer(template):
+        parts.append((template[pos:m.start()], m.group(1)))
+        pos = m.end()
+    parts.append((template[pos:], None))
+    return tuple(parts)
+
+def _fill(parts, mapping: Dict[str, str]) -> str:
+    return "".join(lit + (mapping.get(key, "{" + key + "}") if key else "") for lit, key in parts)
 
 def translate_metaphor(frame: str, template: str) -> str:
     """
@@ -131,9 +162,23 @@ def translate_metaphor(frame: str, template: str) -> str:
     """
     f = normalize_frame(frame)
     mapping = METAPHOR_MAP.get(f, METAPHOR_MAP[PUBLIC_DEFAULT_FRAME])
-    out = template
-    for key, val in mapping.items():
-        out = out.replace("{" + key + "}", val)
+    return _fill(_compile(template), mapping)
+
+def render_many(templates, texts=None, frames=None) -> List[dict]:
+    """
+    Render a batch of templates (e.g. codex bodies) into every frame at once.
+    Returns one {"renders": {frame: text}} per template; each template is
+    parsed once however many frames it goes into. With `texts` (one per
+    template) each item also gets "frame": the frame inferred from its text.
+    """
+    frames = [normalize_frame(f) for f in frames] if frames else list_frames()
+    out = []
+    for i, template in enumerate(templates):
+        parts = _compile(template)
+        item = {"renders": {f: _fill(parts, METAPHOR_MAP[f]) for f in frames}}
+        if texts is not None:
+            item["frame"] = infer_frame_from_text(texts[i])
+        out.append(item)
     return out
 
 def render(template: str, user_text: str = "", frame: str = "") -> str:
@@ -152,19 +197,46 @@ if __name__ == "__main__":
     for fr in ["secular","christian","sufi","buddhist","vedic","taoist","indigenous","jewish","scientific_mystic"]:
         print(f"\n[{fr}] {render(demo, frame=fr)}")
 
-from flask import request, g
+from types import MappingProxyType
+from flask import g, has_request_context, request
+from werkzeug.local import LocalProxy
+
+@lru_cache(maxsize=None)
+def frame_bundle(frame: str) -> MappingProxyType:
+    """Read-only alignment context for one (normalized) frame, built once."""
+    f = normalize_frame(frame)
+    return MappingProxyType({
+        "frame": f,
+        "metaphors": MappingProxyType(METAPHOR_MAP[f]),
+        "sanctum_link_sigil": SANCTUM_LINK_SIGIL,
+        "alignment_charter": ALIGNMENT_CHARTER,
+        "metaphor_map": METAPHOR_MAP,
+    })
+
+def alignment() -> MappingProxyType:
+    """
+    Alignment context for the current request, resolved on first use from
+    the X-Frame header (christian / secular / sufi / ...; aliases allowed).
+    Outside a request, the public default frame.
+    """
+    if not has_request_context():
+        return frame_bundle(PUBLIC_DEFAULT_FRAME)
+    bundle = g.get("alignment")
+    if bundle is None:
+        # normalize before the cache so arbitrary header values share entries
+        bundle = g.alignment = frame_bundle(normalize_frame(request.headers.get("X-Frame", "")))
+    return bundle
+
+current_alignment = LocalProxy(alignment)
 
 def apply_alignment_layer(app):
     """
     Attach alignment layer to the Flask app.
-    Makes alignment constants available per-request via flask.g
+    Nothing runs per request: views call alignment() and templates use
+    {{ alignment.frame }}, {{ alignment.metaphors.source }}, ... which is
+    resolved only when a template actually touches it. Pings, static files
+    and /assets never pay for it.
     """
-    @app.before_request
-    def _attach_alignment():
-        # You can read a header if you want different frames later
-        # (optional) e.g. X-Frame: christian / secular / interfaith
-        g.frame = request.headers.get("X-Frame", "default")
-        g.sanctum_link_sigil = SANCTUM_LINK_SIGIL
-        g.alignment_charter = ALIGNMENT_CHARTER
-        g.metaphor_map = METAPHOR_MAP
-       
\ No newline at end of file
+    @app.context_processor
+    def _alignment_context():
+        return {"alignment": current_alignment}
@@ -0,0 +1,193 @@
+# blobstore.py
+# Content-addressed asset store shared by server.upload and thread ingestion.
+#
+# Every file is stored once under storage/blobs/ab/cd/<sha256><ext>, written
+# to a temp file and renamed into place, so two uploads with the same name can
+# no longer overwrite each other and identical photos are kept once no matter
+# how many threads post them. The ext is the one stored with the blob's row:
+# the same bytes uploaded again as .jpeg reuse the .jpg file.
+#
+# Bookkeeping lives in arch_threads.db (tables created by db.init_db):
+#   blobs(sha256, ext, size, refcount)   refcount = assets rows + names using it
+#   blob_names(name, sha256)             friendly names served at /assets/<name>
+# A blob whose refcount drops to zero is deleted.
+#
+# Hashing and writing the temp file happen outside any transaction. The
+# existence check, the rename into place and the refcount change then run in
+# one write transaction (BEGIN IMMEDIATE), and a blob's file is removed inside
+# the transaction that drops its row, so a concurrent decref can never delete
+# a file that a put or bind has just counted on.
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from db import get_db
+from profiling import timed
+
+BLOB_DIR = Path(__file__).parent / "storage" / "blobs"
+CHUNK = 64 * 1024
+_HASH_NAME = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+
+
+class BlobStore:
+    def __init__(self, root, db_path: str | None = None):
+        self.root = Path(root)
+        self.tmp_dir = self.root / ".tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+
+    # --- files ---
+    def path_for(self, sha256: str, ext: str = "") -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / f"{sha256}{ext.lower()}"
+
+    def stage_bytes(self, data: bytes) -> tuple[str, str]:
+        """Write `data` to a temp file; returns (sha256, temp path) for put_file/bind."""
+        sha = hashlib.sha256(data).hexdigest()
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+        with timed("file_io"), os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return sha, tmp
+
+    def stage_stream(self, stream) -> tuple[str, str]:
+        """Copy a file-like object to a temp file, hashing it as it streams."""
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+        with timed("file_io"), os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = stream.read(CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+                f.write(chunk)
+        return h.hexdigest(), tmp
+
+    def _store(self, conn, tmp_path, sha256: str, ext: str) -> str:
+        """Move a staged file into place and count one reference (caller holds the write lock)."""
+        row = conn.execute("SELECT ext FROM blobs WHERE sha256=?", (sha256,)).fetchone()
+        ext = row["ext"] if row else ext.lower()
+        dest = self.path_for(sha256, ext)
+        if dest.exists():
+            os.remove(tmp_path)          # already stored once
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, dest)
+        if row:
+            conn.execute("UPDATE blobs SET refcount=refcount+1 WHERE sha256=?", (sha256,))
+        else:
+            conn.execute("""INSERT INTO blobs(sha256, ext, size, refcount, created_at)
+                            VALUES(?,?,?,1,?)""",
+                         (sha256, ext, dest.stat().st_size, int(time.time())))
+        return dest.name
+
+    def put_file(self, tmp_path, sha256: str, ext: str = "", conn=None) -> str:
+        """Move an already-hashed temp file into the store and take one reference
+        for the caller; returns the blob name. With `conn`, the caller holds a
+        write transaction and commits; otherwise this runs in its own."""
+        if conn is not None:
+            return self._store(conn, tmp_path, sha256, ext)
+        conn = get_db(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            name = self._store(conn, tmp_path, sha256, ext)
+            conn.commit()
+            return name
+        finally:
+            conn.close()
+
+    def put_bytes(self, data: bytes, ext: str = "", conn=None) -> tuple[str, str]:
+        sha, tmp = self.stage_bytes(data)
+        return sha, self.put_file(tmp, sha, ext, conn)
+
+    def put_stream(self, stream, ext: str = "") -> tuple[str, str]:
+        sha, tmp = self.stage_stream(stream)
+        return sha, self.put_file(tmp, sha, ext)
+
+    # --- reference counts (caller holds a write transaction and commits) ---
+    def incref(self, conn, sha256: str, ext: str = "") -> None:
+        path = self.path_for(sha256, ext)
+        size = path.stat().st_size if path.exists() else None
+        conn.execute("""INSERT INTO blobs(sha256, ext, size, refcount, created_at)
+                        VALUES(?,?,?,1,?)
+                        ON CONFLICT(sha256) DO UPDATE SET refcount=refcount+1""",
+                     (sha256, ext.lower(), size, int(time.time())))
+
+    def decref(self, conn, sha256: str) -> None:
+        conn.execute("UPDATE blobs SET refcount=refcount-1 WHERE sha256=?", (sha256,))
+        row = conn.execute("SELECT ext, refcount FROM blobs WHERE sha256=?", (sha256,)).fetchone()
+        if row and row["refcount"] <= 0:
+            conn.execute("DELETE FROM blobs WHERE sha256=?", (sha256,))
+            # removed while the write lock is still held: nobody can count on
+            # the file between the row going and the file going
+            try:
+                os.remove(self.path_for(sha256, row["ext"]))
+            except FileNotFoundError:
+                pass
+
+    # --- names ---
+    def bound(self, name: str) -> str | None:
+        """sha256 of the blob `name` points at, if any."""
+        conn = get_db(self.db_path)
+        try:
+            row = conn.execute("SELECT sha256 FROM blob_names WHERE name=?", (name,)).fetchone()
+        finally:
+            conn.close()
+        return row["sha256"] if row else None
+
+    def bind(self, name: str, sha256: str, ext: str = "", tmp_path=None) -> bool:
+        """Point `name` at a blob, releasing whatever it pointed at before.
+        tmp_path is the blob's staged file (stage_bytes/stage_stream), stored
+        in the same transaction; without it the blob must already be stored.
+        Returns False if `name` already pointed at the blob."""
+        conn = get_db(self.db_path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            old = conn.execute("SELECT sha256 FROM blob_names WHERE name=?", (name,)).fetchone()
+            if old and old["sha256"] == sha256:
+                conn.rollback()
+                if tmp_path is not None:
+                    os.remove(tmp_path)
+                return False
+            if tmp_path is not None:
+                self._store(conn, tmp_path, sha256, ext)
+            elif conn.execute("UPDATE blobs SET refcount=refcount+1 WHERE sha256=?",
+                              (sha256,)).rowcount == 0:
+                raise LookupError(f"blob {sha256} is not stored")
+            conn.execute("INSERT OR REPLACE INTO blob_names(name, sha256) VALUES(?,?)", (name, sha256))
+            if old:
+                self.decref(conn, old["sha256"])
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+    def names(self) -> list[str]:
+        conn = get_db(self.db_path)
+        try:
+            return [r["name"] for r in conn.execute("SELECT name FROM blob_names")]
+        finally:
+            conn.close()
+
+    def resolve(self, name: str) -> Path | None:
+        """Path for a bound name or a '<sha256><ext>' blob name, if stored."""
+        m = _HASH_NAME.match(name)
+        if m:
+            path = self.path_for(m.group(1), m.group(2) or "")
+            return path if path.exists() else None
+        conn = get_db(self.db_path)
+        try:
+            row = conn.execute("""SELECT b.sha256, b.ext FROM blob_names n
+                                  JOIN blobs b ON b.sha256=n.sha256
+                                  WHERE n.name=?""", (name,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        path = self.path_for(row["sha256"], row["ext"])
+        return path if path.exists() else None
+
+
+blob_store = BlobStore(BLOB_DIR)
@@ -0,0 +1,202 @@
+# codex_index.py
+# In-memory index of storage/codex + storage/assets for the listing routes.
+#
+# /library and /codex used to glob the codex folder, stat every file and probe
+# up to 8 image extensions per entry on each request. The index keeps
+# stem -> {json metadata, paired image, size, mtime} in memory and only
+# rescans when something may have changed:
+#   * the codex or assets directory mtime moved (file added/removed/renamed),
+#   * a writer in this process called invalidate() (in-place rewrites do not
+#     touch the directory mtime), or
+#   * RESCAN_EVERY seconds passed, to catch in-place edits by other workers.
+# A rescan is one scandir per folder; only entries whose size/mtime changed
+# are re-read.
+#
+# Tags get an inverted index (tag -> stems) and precomputed counts, rebuilt
+# with each rescan, so tag filters never open a codex file. Tags match
+# case-insensitively; the spelling seen first (by stem) is the one shown.
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+from codex_reader import codex_reader
+
+# Preference order when several images share a stem (matches the old probes).
+IMAGE_EXTS = [".png", ".jpg", ".jpeg", ".webp", ".PNG", ".JPG", ".JPEG", ".WEBP"]
+META_FIELDS = ("title", "phase", "tags")
+RESCAN_EVERY = 5.0
+
+
+def _load_meta(path: Path) -> dict:
+    # projection read: large design payloads are skipped, not parsed
+    return codex_reader.read_fields(path, META_FIELDS)
+
+
+class CodexIndex:
+    def __init__(self, codex_dir, assets_dir, rescan_every: float = RESCAN_EVERY,
+                 extra_images=None):
+        self.codex_dir = Path(codex_dir)
+        self.assets_dir = Path(assets_dir)
+        self.rescan_every = rescan_every
+        self.extra_images = extra_images   # callable -> image names stored elsewhere
+
+        self._lock = threading.Lock()
+        self._entries = {}      # stem -> entry dict
+        self._images = {}       # stem -> image filename
+        self._tags = {}         # casefolded tag -> sorted stems
+        self._tag_names = {}    # casefolded tag -> display spelling
+        self._tag_counts = []   # [{"tag", "count"}], most used first
+        self._dir_mtimes = None
+        self._checked_at = 0.0
+        self._dirty = True
+        self._etag = None
+
+    # --- public API ---
+    def invalidate(self, stem: str | None = None) -> None:
+        """Force the next lookup to rescan (call after writing codex/assets)."""
+        with self._lock:
+            self._dirty = True
+            if stem is not None:
+                self._entries.pop(stem, None)
+
+    def entries(self) -> tuple[list, str]:
+        """Sorted codex entries and an ETag for the listing."""
+        with self._lock:
+            self._refresh()
+            rows = [self._entries[s] for s in sorted(self._entries)]
+            return rows, self._etag
+
+    def get(self, stem: str) -> dict | None:
+        with self._lock:
+            self._refresh()
+            return self._entries.get(stem)
+
+    def with_tag(self, tag: str) -> tuple[list, str]:
+        """Entries carrying `tag` and an ETag for that filtered listing."""
+        key = tag.strip().casefold()
+        with self._lock:
+            self._refresh()
+            rows = [self._entries[s] for s in self._tags.get(key, ())]
+            etag = hashlib.sha1(f"{self._etag}|{key}".encode("utf-8")).hexdigest()
+            return rows, etag
+
+    def tags(self) -> tuple[list, str]:
+        """[{"tag", "count"}] for every tag, most used first, and the listing ETag."""
+        with self._lock:
+            self._refresh()
+            return self._tag_counts, self._etag
+
+    def tag_name(self, tag: str) -> str | None:
+        with self._lock:
+            self._refresh()
+            return self._tag_names.get(tag.strip().casefold())
+
+    def image_for(self, stem: str) -> str | None:
+        with self._lock:
+            self._refresh()
+            return self._images.get(stem)
+
+    # --- internals (call with _lock held) ---
+    def _dir_state(self):
+        out = []
+        for d in (self.codex_dir, self.assets_dir):
+            try:
+                out.append(os.stat(d).st_mtime_ns)
+            except FileNotFoundError:
+                out.append(None)
+        return tuple(out)
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        state = self._dir_state()
+        if (not self._dirty and state == self._dir_mtimes
+                and now - self._checked_at < self.rescan_every):
+            return
+        self._scan_assets()
+        self._scan_codex()
+        self._index_tags()
+        self._dir_mtimes = state
+        self._checked_at = now
+        self._dirty = False
+
+    def _scan_assets(self) -> None:
+        rank = {ext: i for i, ext in enumerate(IMAGE_EXTS)}
+        best = {}
+        for name in (self.extra_images() if self.extra_images else ()):
+            stem, ext = os.path.splitext(name)
+            if ext in rank and (stem not in best or rank[ext] < rank[os.path.splitext(best[stem])[1]]):
+                best[stem] = name
+        try:
+            it = os.scandir(self.assets_dir)
+        except FileNotFoundError:
+            it = None
+        if it is not None:
+            with it:
+                for de in it:
+                    stem, ext = os.path.splitext(de.name)
+                    if ext not in rank or not de.is_file():
+                        continue
+                    cur = best.get(stem)
+                    if cur is None or rank[ext] < rank[os.path.splitext(cur)[1]]:
+                        best[stem] = de.name
+        self._images = best
+
+    def _scan_codex(self) -> None:
+        old = self._entries
+        new = {}
+        try:
+            it = os.scandir(self.codex_dir)
+        except FileNotFoundError:
+            it = None
+        if it is not None:
+            with it:
+                for de in it:
+                    if not de.name.endswith(".json") or not de.is_file():
+                        continue
+                    st = de.stat()
+                    stem = de.name[:-5]
+                    prev = old.get(stem)
+                    if prev and prev["size"] == st.st_size and prev["mtime_ns"] == st.st_mtime_ns:
+                        meta = prev["meta"]
+                    else:
+                        meta = _load_meta(Path(de.path))
+                    new[stem] = {
+                        "stem": stem,
+                        "name": de.name,
+                        "size": st.st_size,
+                        "mtime": st.st_mtime,
+                        "mtime_ns": st.st_mtime_ns,
+                        "meta": meta,
+                        "image": self._images.get(stem),
+                    }
+        self._entries = new
+
+        h = hashlib.sha1()
+        for stem in sorted(new):
+            e = new[stem]
+            h.update(f"{e['name']}|{e['size']}|{e['mtime_ns']}|{e['image']}\n".encode("utf-8"))
+        self._etag = h.hexdigest()
+
+    def _index_tags(self) -> None:
+        tags, names = {}, {}
+        for stem in sorted(self._entries):
+            raw = self._entries[stem]["meta"].get("tags") or []
+            if isinstance(raw, str):
+                raw = [raw]
+            seen = set()
+            for t in raw:
+                if not isinstance(t, str) or not t.strip():
+                    continue
+                key = t.strip().casefold()
+                if key in seen:
+                    continue
+                seen.add(key)
+                names.setdefault(key, t.strip())
+                tags.setdefault(key, []).append(stem)
+        self._tags = tags
+        self._tag_names = names
+        self._tag_counts = [{"tag": names[k], "count": len(v)}
+                            for k, v in sorted(tags.items(), key=lambda kv: (-len(kv[1]), kv[0]))]
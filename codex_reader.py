@@ -0,0 +1,216 @@
+# codex_reader.py
+# Reading codex JSON without paying for a full parse every time.
+#
+#   pretty_text(path)          text for the preview/edit pages. Files that are
+#                              already stored pretty-printed (what _write_json
+#                              writes) are served as their own bytes; the
+#                              verdict comes from one parse per mtime/size.
+#                              Other text is cached only for files up to
+#                              CACHE_DATA_MAX and rebuilt on demand above it.
+#   load(path)                 parsed document, cached per mtime/size; the
+#                              caller gets its own copy unless it passes
+#                              copy=False and promises not to mutate it
+#   read_fields(path, fields)  only the named top-level fields: the file is
+#                              memory-mapped and the other values are skipped
+#                              over, never decoded (big design payloads stay
+#                              on disk)
+#
+# A UTF-8 BOM (common for files saved on Windows) is ignored everywhere.
+
+import copy as _copy
+import json
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from profiling import timed
+
+BOM = b"\xef\xbb\xbf"
+CACHE_ENTRIES = 128
+CACHE_DATA_MAX = 2 * 1024 * 1024    # keep parsed documents and display text only for files up to this size
+
+_STRING = re.compile(rb'"(?:[^"\\]+|\\.)*"', re.S)
+# a run of anything but brackets, strings included, consumed in one regex call
+_RUN = re.compile(rb'(?:[^"\[\]{}\\]+|"(?:[^"\\]+|\\.)*")*', re.S)
+_WS = re.compile(rb"[ \t\r\n]*")
+_SCALAR_END = re.compile(rb"[,}\]\s]")
+
+
+def _pretty(data) -> str:
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+# ---------- field projection ----------
+def _ws(buf, i: int) -> int:
+    return _WS.match(buf, i).end()
+
+
+def _value_end(buf, i: int) -> int:
+    """Index just past the JSON value starting at i, without decoding it."""
+    c = buf[i:i + 1]
+    if c == b'"':
+        m = _STRING.match(buf, i)
+        if not m:
+            raise ValueError("unterminated string")
+        return m.end()
+    if c in (b"[", b"{"):
+        depth, pos = 0, i
+        while True:
+            c = buf[pos:pos + 1]
+            if c in (b"[", b"{"):
+                depth += 1
+                pos += 1
+            elif c in (b"]", b"}"):
+                depth -= 1
+                pos += 1
+                if depth == 0:
+                    return pos
+            else:
+                end = _RUN.match(buf, pos).end()
+                if end == pos:
+                    raise ValueError("malformed JSON")
+                pos = end
+    m = _SCALAR_END.search(buf, i)
+    return m.start() if m else len(buf)
+
+
+def project(buf, fields) -> dict:
+    """Top-level `fields` of the JSON object in buf (bytes or mmap)."""
+    want = set(fields)
+    out = {}
+    i = _ws(buf, 3 if buf[:3] == BOM else 0)
+    if buf[i:i + 1] != b"{":
+        raise ValueError("not a JSON object")
+    i = _ws(buf, i + 1)
+    if buf[i:i + 1] == b"}":
+        return out
+    while True:
+        m = _STRING.match(buf, i)
+        if not m:
+            raise ValueError("expected a key")
+        key = json.loads(m.group())
+        i = _ws(buf, m.end())
+        if buf[i:i + 1] != b":":
+            raise ValueError("expected ':'")
+        i = _ws(buf, i + 1)
+        end = _value_end(buf, i)
+        if key in want:
+            out[key] = json.loads(buf[i:end])
+            if len(out) == len(want):
+                return out
+        i = _ws(buf, end)
+        c = buf[i:i + 1]
+        if c == b"}":
+            return out
+        if c != b",":
+            raise ValueError("expected ',' or '}'")
+        i = _ws(buf, i + 1)
+
+
+# ---------- reader ----------
+class CodexReader:
+    def __init__(self, max_entries: int = CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()     # path -> (mtime_ns, size, record)
+        self._lock = threading.Lock()
+
+    def _record(self, path: Path):
+        """(record, display text or None); record = {"valid", "pretty", "text", "data"}.
+        The display text is only returned when the file was read by this call."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        key = str(path)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+                self._cache.move_to_end(key)
+                return hit[2], None
+
+        with timed("file_io"):
+            raw = path.read_bytes()
+        if raw.startswith(BOM):
+            raw = raw[len(BOM):]
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:      # e.g. a PDF that landed in the folder
+            text = None
+        rec = {"valid": False, "pretty": False, "text": None, "data": None}
+        shown = None
+        small = st.st_size <= CACHE_DATA_MAX
+        if text is not None:
+            try:
+                data = json.loads(text)
+            except ValueError:
+                shown = text            # not JSON: show it as it is
+            else:
+                pretty = _pretty(data)
+                rec["valid"] = True
+                rec["pretty"] = text.rstrip() == pretty
+                shown = text if rec["pretty"] else pretty
+                if small:
+                    rec["data"] = data
+            if small and not rec["pretty"]:
+                rec["text"] = shown     # big files rebuild it on demand (pretty_text)
+        with self._lock:
+            self._cache[key] = (st.st_mtime_ns, st.st_size, rec)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return rec, shown
+
+    def pretty_text(self, path) -> str | None:
+        """Indented JSON for display (raw text if the file isn't JSON)."""
+        path = Path(path)
+        rec, shown = self._record(path)
+        if rec is None:
+            return None
+        if rec["text"] is not None:
+            return rec["text"]
+        if shown is not None:
+            return shown
+        # cache hit on a pretty or big file: rebuild from the bytes on disk
+        try:
+            with timed("file_io"):
+                text = path.read_bytes().removeprefix(BOM).decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            return None
+        if rec["valid"] and not rec["pretty"]:
+            try:
+                return _pretty(json.loads(text))
+            except ValueError:
+                return None
+        return text
+
+    def load(self, path, copy: bool = True):
+        """Parsed document or None. copy=False returns the cached object itself
+        (faster, but it is shared: the caller must not mutate it)."""
+        path = Path(path)
+        rec, _ = self._record(path)
+        if rec is None or not rec["valid"]:
+            return None
+        if rec["data"] is not None:
+            return _copy.deepcopy(rec["data"]) if copy else rec["data"]
+        try:        # too big to keep around: parse on demand
+            return json.loads(path.read_bytes().removeprefix(BOM))
+        except (OSError, ValueError):
+            return None
+
+    def read_fields(self, path, fields) -> dict:
+        """Only the requested top-level fields; {} if unreadable or not an object."""
+        try:
+            with timed("file_io"), open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return {}
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    return project(buf, fields)
+        except (OSError, ValueError):
+            data = self.load(path)
+            return {k: data[k] for k in fields if k in data} if isinstance(data, dict) else {}
+
+
+codex_reader = CodexReader()
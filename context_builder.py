@@ -0,0 +1,237 @@
+# context_builder.py
+# Assembles the prompt for Tharn’el within a fixed token budget.
+#
+#   system   base prompt + rolling summary + a few relevant SovLang snippets
+#   history  the most recent turns from data/communion.db (conversations),
+#            newest first until the budget runs out
+#   user     the current message (always sent)
+#
+# The rolling summary lives in memory_summary (arch_threads.db). Turns that
+# fall out of the recent window are folded into it incrementally, at most
+# FOLD_MAX messages at a time, once SUMMARY_EVERY of them have piled up;
+# memory_summary.through_id marks the last conversation row folded in. Folds
+# run on one background thread per process so the reply that triggers one
+# is not delayed. Prompt size therefore stays bounded however long a guest's
+# history gets.
+#
+# Token counts are estimated at ~4 characters per token; no tokenizer needed.
+#
+# New turns are written through a ConversationWriter (conv_writer.py), which
+# group-commits them with other guests' turns.
+
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+from conv_writer import ConversationWriter
+from db import get_db
+from model_gateway import gateway
+import profiling
+
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))   # prompt tokens
+RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "12"))     # messages kept verbatim
+SUMMARY_EVERY = int(os.getenv("CONTEXT_SUMMARY_EVERY", "10"))   # messages per fold
+FOLD_MAX = 40                # messages folded per pass (bounds the summarizer prompt)
+SUMMARY_MAX_CHARS = 1200
+TURN_MAX_CHARS = 2000
+SNIPPET_LIMIT = 3
+CHARS_PER_TOKEN = 4
+
+_WORD = re.compile(r"[\w’']+")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or "") // CHARS_PER_TOKEN + 1
+
+
+def _clip(text: str, limit: int) -> str:
+    text = text or ""
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _words(text: str) -> set:
+    return {w for w in _WORD.findall((text or "").lower()) if len(w) > 2}
+
+
+def relevant_snippets(user_text: str, entries, limit: int = SNIPPET_LIMIT) -> list[str]:
+    """SovLang memory lines sharing the most words with user_text (newest wins ties)."""
+    want = _words(user_text)
+    if not want:
+        return []
+    scored = []
+    seen = set()
+    for i, e in enumerate(entries or ()):
+        text = ((e.get("text") or "") if isinstance(e, dict) else str(e)).strip()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        score = len(want & _words(text))
+        if score:
+            scored.append((score, i, text))
+    scored.sort(reverse=True)
+    return [_clip(t, 240) for _, _, t in scored[:limit]]
+
+
+class ContextBuilder:
+    def __init__(self, conv_db: str, summary_db: str | None = None,
+                 budget: int = TOKEN_BUDGET, recent_turns: int = RECENT_TURNS,
+                 summary_every: int = SUMMARY_EVERY, writer: ConversationWriter | None = None):
+        self.conv_db = conv_db
+        self.writer = writer or ConversationWriter(conv_db)
+        self.summary_db = summary_db     # None -> db.DB_PATH (arch_threads.db)
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self.summary_every = summary_every
+        self._queue = queue.Queue()     # user ids waiting for a fold check
+        self._pending = set()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    # --- reads ---
+    def summary(self, user_id: str) -> tuple[str, int]:
+        conn = get_db(self.summary_db)
+        try:
+            row = conn.execute("SELECT summary, through_id FROM memory_summary WHERE guest_id=?",
+                               (user_id,)).fetchone()
+        finally:
+            conn.close()
+        return (row["summary"] or "", row["through_id"] or 0) if row else ("", 0)
+
+    def recent(self, user_id: str, limit: int) -> list[dict]:
+        conn = get_db(self.conv_db)
+        try:
+            rows = conn.execute("""SELECT role, content FROM conversations
+                                   WHERE user_id=? ORDER BY id DESC LIMIT ?""",
+                                (user_id, limit)).fetchall()
+        finally:
+            conn.close()
+        return [{"role": r["role"], "content": r["content"] or ""} for r in rows]   # newest first
+
+    def build(self, user_id: str, user_text: str, system: str, sov_entries=()) -> list[dict]:
+        """Chat messages for the model: system, recent history, user message."""
+        summary, _ = self.summary(user_id)
+        parts = [system]
+        if summary:
+            parts.append("What you remember of earlier conversation with this guest:\n"
+                         + _clip(summary, SUMMARY_MAX_CHARS))
+        snippets = relevant_snippets(user_text, sov_entries)
+        if snippets:
+            parts.append("SovLang phrases this guest has used before:\n"
+                         + "\n".join(f"- {s}" for s in snippets))
+        system_content = "\n\n".join(parts)
+
+        left = self.budget - estimate_tokens(system_content) - estimate_tokens(user_text)
+        history = []
+        for m in self.recent(user_id, self.recent_turns):
+            if m["role"] not in ("user", "assistant"):
+                continue
+            content = _clip(m["content"], TURN_MAX_CHARS)
+            cost = estimate_tokens(content)
+            if cost > left:
+                break
+            left -= cost
+            history.append({"role": m["role"], "content": content})
+        history.reverse()
+
+        return ([{"role": "system", "content": system_content}]
+                + history
+                + [{"role": "user", "content": user_text}])
+
+    # --- writes ---
+    def record_turn(self, user_id: str, user_text: str, reply: str, durable: bool = False) -> None:
+        """Queue the exchange for the next group commit; durable=True waits for the fsync."""
+        fut = self.writer.submit([(user_id, "user", user_text), (user_id, "assistant", reply)],
+                                 durable=durable)
+
+        def saved(f):
+            if f.exception() is not None:
+                print(f"⚠️ chat turn not saved for {user_id}: {f.exception()}")
+            else:
+                self.maybe_fold(user_id)
+
+        fut.add_done_callback(saved)
+        if durable:
+            fut.result()
+
+    def maybe_fold(self, user_id: str) -> None:
+        if sys.is_finalizing():     # a reply stream closed at interpreter exit
+            return
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._fold_worker, daemon=True,
+                                                name="summary-fold")
+                self._worker.start()
+        self._queue.put(user_id)
+
+    def _fold_worker(self) -> None:
+        while True:
+            user_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(user_id)
+            try:
+                with profiling.job("summary_fold"):
+                    self.fold(user_id)
+            except Exception as e:
+                print(f"⚠️ summary fold skipped for {user_id}: {e}")
+
+    def fold(self, user_id: str) -> bool:
+        """Fold turns older than the recent window into the summary, if enough piled up."""
+        summary, through = self.summary(user_id)
+        conn = get_db(self.conv_db)
+        try:
+            edge = conn.execute("""SELECT id FROM conversations WHERE user_id=?
+                                   ORDER BY id DESC LIMIT 1 OFFSET ?""",
+                                (user_id, self.recent_turns)).fetchone()
+            if edge is None:
+                return False
+            rows = conn.execute("""SELECT id, role, content FROM conversations
+                                   WHERE user_id=? AND id>? AND id<=?
+                                   ORDER BY id LIMIT ?""",
+                                (user_id, through, edge["id"], FOLD_MAX)).fetchall()
+        finally:
+            conn.close()
+        if len(rows) < self.summary_every:
+            return False
+
+        new_summary = _clip(summarize(summary, rows), SUMMARY_MAX_CHARS)
+        conn = get_db(self.summary_db)
+        try:
+            conn.execute("""INSERT INTO memory_summary (guest_id, summary, through_id, updated_at)
+                            VALUES (?, ?, ?, ?)
+                            ON CONFLICT(guest_id) DO UPDATE SET
+                              summary=excluded.summary,
+                              through_id=excluded.through_id,
+                              updated_at=excluded.updated_at""",
+                         (user_id, new_summary, rows[-1]["id"], int(time.time())))
+            conn.commit()
+        finally:
+            conn.close()
+        return True
+
+
+def summarize(previous: str, rows) -> str:
+    """Updated rolling summary: the model when it is reachable, otherwise extractive."""
+    transcript = "\n".join(f"{r['role']}: {_clip(r['content'], 400)}" for r in rows)
+    if gateway.available:
+        try:
+            out = gateway.complete([
+                {"role": "system", "content":
+                    "You keep Tharn’el's running memory of a guest. Merge the new exchanges "
+                    "into the memory: names, ongoing projects, promises, feelings worth "
+                    "remembering. At most 150 words, plain prose, no preamble."},
+                {"role": "user", "content":
+                    f"Memory so far:\n{previous or '(empty)'}\n\nNew exchanges:\n{transcript}"},
+            ], temperature=0.2)
+            if out:
+                return out
+        except Exception:
+            pass    # busy or unreachable: fall through to the extractive summary
+    said = "; ".join(_clip(r["content"], 80) for r in rows if r["role"] == "user")
+    merged = f"{previous} {said}".strip() if previous else said
+    return merged[-SUMMARY_MAX_CHARS:]
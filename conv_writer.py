@@ -0,0 +1,136 @@
+# conv_writer.py
+# Group commit for inserts into `conversations` (data/communion.db).
+#
+# Each exchange used to cost its own INSERT + commit round trips. Here
+# writers hand their rows to one background thread, which gathers
+# everything queued within BATCH_DELAY seconds (or until BATCH_MAX rows)
+# and commits it as a single transaction. Ten chats landing at once cost
+# one commit instead of twenty.
+#
+# The database runs in WAL mode with synchronous=NORMAL (see db.py), so a
+# plain commit appends to the WAL and does not fsync. A durable write asks
+# for synchronous=FULL, and the batch that carries it is fsynced before
+# any of its callers return. Durability is picked per call:
+#
+#   submit(rows)                 -> Future[list of ids], nothing waits
+#   insert(rows, durable=True)   -> list of ids, once the batch is on disk
+#
+# If one request in a batch fails, the others are retried one at a time,
+# so a bad row only fails its own caller. Committed rows are added to the
+# search index (search_index.py) in one write per batch, before the
+# futures resolve.
+
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+from db import get_db
+import profiling
+import search_index
+
+BATCH_MAX = int(os.getenv("CONV_BATCH_MAX", "64"))                   # rows per commit
+BATCH_DELAY = int(os.getenv("CONV_BATCH_DELAY_MS", "5")) / 1000     # gather window
+
+INSERT = "INSERT INTO conversations (user_id, role, content) VALUES (?, ?, ?)"
+
+
+class ConversationWriter:
+    def __init__(self, db_path: str, batch_max: int = BATCH_MAX, batch_delay: float = BATCH_DELAY):
+        self.db_path = db_path
+        self.batch_max = batch_max
+        self.batch_delay = batch_delay
+        self._queue = queue.Queue()     # (rows, durable, future); None stops the worker
+        self._worker = None
+        self._lock = threading.Lock()
+        self._closed = False
+        atexit.register(self.close)
+
+    def submit(self, rows, durable: bool = False) -> Future:
+        """Queue rows of (user_id, role, content); the future gets their ids."""
+        req = (list(rows), durable, Future())
+        with self._lock:
+            inline = self._closed or sys.is_finalizing()
+            if not inline and (self._worker is None or not self._worker.is_alive()):
+                self._worker = threading.Thread(target=self._run, daemon=True, name="conv-writer")
+                self._worker.start()
+            if not inline:
+                self._queue.put(req)    # under the lock, so never behind close()'s None
+        if inline:      # shutting down: no worker left to hand it to
+            self._commit([req])
+        return req[2]
+
+    def insert(self, rows, durable: bool = True) -> list[int]:
+        """Insert and wait for the commit; returns the new row ids."""
+        return self.submit(rows, durable).result()
+
+    def close(self) -> None:
+        """Commit whatever is queued and stop the worker."""
+        with self._lock:
+            self._closed = True
+            worker = self._worker
+        if worker is not None and worker.is_alive():
+            self._queue.put(None)
+            worker.join(timeout=10)
+
+    # --- worker ---
+    def _run(self) -> None:
+        while True:
+            req = self._queue.get()
+            if req is None:
+                return
+            batch, n = [req], len(req[0])
+            deadline = time.monotonic() + self.batch_delay
+            stop = False
+            while n < self.batch_max:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                try:
+                    req = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    break
+                if req is None:
+                    stop = True
+                    break
+                batch.append(req)
+                n += len(req[0])
+            with profiling.job("conv_writer"):
+                self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch) -> None:
+        try:
+            ids = self._write(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            for req in batch:       # find the bad one; the rest still go in
+                self._commit([req])
+            return
+        search_index.index_chat((rid, role, content)
+                                for (rows, _, _), rids in zip(batch, ids)
+                                for rid, (_, role, content) in zip(rids, rows))
+        for (_, _, fut), rids in zip(batch, ids):
+            fut.set_result(rids)
+
+    def _write(self, batch) -> list[list[int]]:
+        durable = any(d for _, d, _ in batch)
+        conn = get_db(self.db_path)
+        try:
+            if durable:
+                conn.execute("PRAGMA synchronous=FULL")
+            try:
+                ids = [[conn.execute(INSERT, row).lastrowid for row in rows] for rows, _, _ in batch]
+                conn.commit()
+            finally:
+                if durable:
+                    conn.execute("PRAGMA synchronous=NORMAL")
+        finally:
+            conn.close()
+        return ids
@@ -1,12 +1,162 @@
 # db.py
-import sqlite3, os
+# Shared SQLite connection layer for every blueprint.
+#
+# get_db(path) hands out a pooled connection for that database file. The
+# connection is opened once per worker with WAL + synchronous=NORMAL already
+# applied and keeps its prepared-statement cache warm between requests.
+# conn.close() returns it to the pool instead of closing it, and anything a
+# view forgot to close is returned on app-context teardown (see init_app).
+# Time spent in SQLite is reported to profiling.py.
+import sqlite3, os, threading
+from time import perf_counter
+from flask import g, has_app_context
+import profiling
+
 DB_PATH = os.environ.get("ARCH_DB", "arch_threads.db")
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))   # idle connections kept per file
+STATEMENT_CACHE = 256                                   # prepared statements per connection
+BUSY_TIMEOUT_MS = 5000
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor whose statements count as "sqlite" time. Fetches are not timed:
+    a Python wrapper per row made large scans several times slower."""
+
+
+def _timed(name):
+    base = getattr(sqlite3.Cursor, name)
+
+    def method(self, *args, **kwargs):
+        t0 = perf_counter()
+        try:
+            return base(self, *args, **kwargs)
+        finally:
+            profiling.add("sqlite", perf_counter() - t0)
+    method.__name__ = name
+    return method
+
+for _name in ("execute", "executemany", "executescript"):
+    setattr(TimedCursor, _name, _timed(_name))
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool."""
+
+    # sqlite3.Connection.execute* bypass cursor(), so route them through it
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+    def commit(self):
+        t0 = perf_counter()
+        try:
+            super().commit()
+        finally:
+            profiling.add("sqlite", perf_counter() - t0)
+
+    def close(self):
+        pool = getattr(self, "pool", None)
+        if pool is None:
+            return super().close()
+        pool.release(self)
+
+    def discard(self):
+        sqlite3.Connection.close(self)
+
+
+class _Pool:
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        conn.lease = object()   # identifies this checkout
+        return conn
+
+    def release(self, conn: PooledConnection, lease=None) -> None:
+        # lease=None: the holder itself closed it; otherwise only release
+        # if the connection has not been handed to someone else since
+        if conn.lease is None or (lease is not None and conn.lease is not lease):
+            return
+        conn.lease = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()   # same as sqlite3: uncommitted work is dropped on close
+        except sqlite3.Error:
+            conn.discard()
+            return
+        with self._lock:
+            if os.getpid() == self.pid and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def _connect(self) -> PooledConnection:
+        conn = sqlite3.connect(
+            self.path,
+            factory=PooledConnection,
+            check_same_thread=False,     # pooled across threads, used by one at a time
+            cached_statements=STATEMENT_CACHE,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.pool = self
+        return conn
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def _pool_for(path: str) -> _Pool:
+    key = os.path.abspath(path)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        # a forked worker must not reuse the parent's connections
+        if pool is None or pool.pid != os.getpid():
+            pool = _POOLS[key] = _Pool(path)
+        return pool
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+def get_db(path: str | None = None):
+    conn = _pool_for(path or DB_PATH).acquire()
+    if has_app_context():
+        g.setdefault("_db_conns", []).append((conn, conn.lease))
     return conn
 
+def release_request_connections(exc=None):
+    for conn, lease in g.pop("_db_conns", []):
+        conn.pool.release(conn, lease)
+
+def init_app(app):
+    app.teardown_appcontext(release_request_connections)
+
+def _add_column(cur, table, column, decl):
+    cols = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    if column in cols:
+        return
+    try:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    except sqlite3.OperationalError as e:
+        if "duplicate column" not in str(e):   # another worker got there first
+            raise
+
 def init_db():
     conn = get_db()
     cur = conn.cursor()
@@ -50,5 +200,91 @@ def init_db():
     /* fast lookups for continuity chains by SHA */
     CREATE INDEX IF NOT EXISTS idx_assets_sha ON assets(sha256);
     CREATE INDEX IF NOT EXISTS idx_posts_thread ON posts(thread_id);
+    /* keyset pages of a thread + batched asset fetch per page */
+    CREATE INDEX IF NOT EXISTS idx_posts_thread_created ON posts(thread_id, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_assets_post ON assets(post_id);
+
+    /* content-addressed files (see blobstore.py) */
+    CREATE TABLE IF NOT EXISTS blobs(
+      sha256 TEXT PRIMARY KEY,
+      ext TEXT,
+      size INTEGER,
+      refcount INTEGER NOT NULL DEFAULT 0,
+      created_at INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS blob_names(
+      name TEXT PRIMARY KEY,
+      sha256 TEXT NOT NULL REFERENCES blobs(sha256)
+    );
+
+    /* studio saves and projects (see studio_store.py) */
+    CREATE TABLE IF NOT EXISTS studio_entries(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      payload TEXT NOT NULL,
+      saved_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS projects(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT NOT NULL,
+      created_at INTEGER
+    );
+
+    /* one-time data imports already applied */
+    CREATE TABLE IF NOT EXISTS migrations(
+      name TEXT PRIMARY KEY,
+      applied_at INTEGER
+    );
+    """)
+
+    # --- columns added after the first schema ---
+    _add_column(cur, "assets", "phash", "TEXT")   # 64-bit perceptual hash, hex
+    _add_column(cur, "assets", "status", "TEXT DEFAULT 'ready'")   # pending|processing|ready|failed
+    _add_column(cur, "assets", "web_sha256", "TEXT")   # hash of the served web copy; sha256 is the original
+    _add_column(cur, "memory_summary", "through_id", "INTEGER DEFAULT 0")   # last conversations.id folded in
+    _add_column(cur, "memory_summary", "updated_at", "INTEGER")
+    _add_column(cur, "assets", "phash_seq", "INTEGER")   # order phashes were written in (see phash_index.py)
+    _add_column(cur, "assets", "claimed_at", "INTEGER")  # when an ingest worker took the row
+
+    # phash_seq is stamped by triggers whenever a phash is written, by any
+    # code path or worker; writes are serialized, so it only ever grows
+    cur.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_assets_phash_seq ON assets(phash_seq);
+
+    CREATE TRIGGER IF NOT EXISTS assets_phash_seq_ai AFTER INSERT ON assets
+    WHEN new.phash IS NOT NULL BEGIN
+      UPDATE assets SET phash_seq=(SELECT COALESCE(MAX(phash_seq), 0) + 1 FROM assets)
+      WHERE rowid=new.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS assets_phash_seq_au AFTER UPDATE OF phash ON assets
+    WHEN new.phash IS NOT NULL BEGIN
+      UPDATE assets SET phash_seq=(SELECT COALESCE(MAX(phash_seq), 0) + 1 FROM assets)
+      WHERE rowid=new.rowid;
+    END;
+    """)
+    cur.execute("""UPDATE assets SET phash_seq=rowid + (SELECT COALESCE(MAX(phash_seq), 0) FROM assets)
+                   WHERE phash IS NOT NULL AND phash_seq IS NULL""")
+    conn.commit()
+
+    # studio_entries row count, kept by triggers so a save never has to
+    # COUNT(*) the table; seeded once, in the same transaction that adds
+    # the triggers, so no insert is missed or counted twice
+    cur.executescript("""
+    BEGIN IMMEDIATE;
+    CREATE TABLE IF NOT EXISTS row_counts(
+      name TEXT PRIMARY KEY,
+      n INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO row_counts(name, n)
+      SELECT 'studio_entries', COUNT(*) FROM studio_entries
+      WHERE NOT EXISTS (SELECT 1 FROM row_counts WHERE name='studio_entries');
+    CREATE TRIGGER IF NOT EXISTS studio_entries_count_ai AFTER INSERT ON studio_entries BEGIN
+      UPDATE row_counts SET n=n+1 WHERE name='studio_entries';
+    END;
+    CREATE TRIGGER IF NOT EXISTS studio_entries_count_ad AFTER DELETE ON studio_entries BEGIN
+      UPDATE row_counts SET n=n-1 WHERE name='studio_entries';
+    END;
+    COMMIT;
     """)
-    conn.commit(); conn.close()
+    conn.close()
@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request, jsonify
-import os, json, datetime
+import studio_store
 
 foundation_ui = Blueprint("foundation_ui", __name__, template_folder="templates", static_folder="static")
 
@@ -24,17 +24,14 @@ def studio():
 @foundation_ui.route("/studio/save", methods=["POST"], endpoint="studio_save")
 def studio_save():
     payload = request.get_json(force=True)
-    os.makedirs("data", exist_ok=True)
-    path = os.path.join("data", "entries.json")
-    entries = []
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            try:
-                entries = json.load(f)
-            except Exception:
-                entries = []
-    payload["saved_at"] = datetime.datetime.now().isoformat(timespec="seconds")
-    entries.append(payload)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(entries, f, ensure_ascii=False, indent=2)
-    return jsonify({"ok": True, "count": len(entries)})
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "expected a JSON object"}), 400
+    saved = studio_store.add_entry(payload)   # one INSERT, see studio_store.py
+    return jsonify({"ok": True, "id": saved["id"], "count": saved["count"]})
+
+@foundation_ui.route("/studio/entries", methods=["GET"], endpoint="studio_entries")
+def studio_entries():
+    # ?after_id=<id>&limit=N, oldest first
+    entries, next_after = studio_store.list_entries(request.args.get("after_id", 0, type=int),
+                                                     request.args.get("limit", studio_store.PAGE_DEFAULT, type=int))
+    return jsonify({"entries": entries, "next_after_id": next_after})
@@ -0,0 +1,204 @@
+# ingest.py
+# Background image ingestion for thread uploads.
+#
+# add_post only streams the raw upload to disk (hashing the original bytes
+# as they arrive) and inserts the asset row with status 'pending'. If an
+# asset with the same original hash is already ready, its derived copy is
+# reused and nothing is decoded at all. Otherwise the heavy part runs here on
+# a small thread pool (PIL and imagehash release the GIL while
+# decoding/resizing/DCT-ing):
+#   read once -> decode once -> EXIF + phash from that decoded image ->
+#   thumbnail to the web size -> encode into memory, hash those bytes ->
+#   store in the blob store and mark the row 'ready' in one transaction
+#   (or 'failed').
+# Jobs claim their row with UPDATE ... WHERE status='pending', so a job
+# requeued by another worker (resume_pending) is never processed twice.
+# A claim older than STALE_AFTER seconds is taken to belong to a worker that
+# died mid-job, and resume_pending puts it back to 'pending'. The staged
+# upload is deleted only once the row is committed as 'ready' (or 'failed'),
+# so a retried job always finds it; a pending row whose staged upload is gone
+# cannot be retried and resume_pending marks it 'failed'.
+#
+# assets.sha256 is the hash of what the user uploaded; assets.web_sha256 is
+# the hash of the derived web copy that is actually served, which lives in
+# blobstore.py's content-addressed store at /assets/<web_sha256><ext> and is
+# reference-counted once per asset row.
+
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import imagehash
+from PIL import Image, ExifTags
+from werkzeug.utils import secure_filename
+
+from blobstore import blob_store
+from db import get_db
+from profiling import job, timed
+
+WORKERS = int(os.environ.get("INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+CHUNK = 64 * 1024
+WEB_SIZE = (1920, 1920)
+WEB_QUALITY = 88
+STALE_AFTER = 600       # seconds a 'processing' claim may last before it is retried
+
+
+def _exif_of(im) -> dict:
+    exif = {}
+    try:
+        raw = (im._getexif() if hasattr(im, "_getexif") else None) or dict(im.getexif())
+        for k, v in raw.items():
+            exif[ExifTags.TAGS.get(k, str(k))] = v
+    except Exception:
+        pass
+    return exif
+
+
+class Ingestor:
+    def __init__(self, upload_dir: str, workers: int = WORKERS, blobs=blob_store):
+        self.upload_dir = upload_dir
+        self.blobs = blobs
+        self.incoming_dir = os.path.join(upload_dir, ".incoming")
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+
+    # --- request side ---
+    def stage(self, file_storage, aid: str) -> dict:
+        """Stream the raw upload for `aid` to disk, hashing it on the way."""
+        fn = secure_filename(file_storage.filename or f"img_{int(time.time()*1000)}.jpg")
+        incoming = os.path.join(self.incoming_dir, aid + os.path.splitext(fn)[1].lower())
+        h = hashlib.sha256()
+        with open(incoming, "wb") as out:
+            while True:
+                chunk = file_storage.stream.read(CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+                out.write(chunk)
+        return {"aid": aid, "incoming": incoming, "sha256": h.hexdigest()}
+
+    def find_ready(self, cur, sha256: str):
+        """An already-processed asset with the same original bytes, if any."""
+        return cur.execute("""SELECT url, web_sha256, phash, exif_json FROM assets
+                              WHERE sha256=? AND status='ready' AND web_sha256 IS NOT NULL
+                              LIMIT 1""", (sha256,)).fetchone()
+
+    def reuse(self, cur, done) -> None:
+        """Count one more asset row against an existing web copy (caller commits)."""
+        self.blobs.incref(cur.connection, done["web_sha256"], os.path.splitext(done["url"])[1])
+
+    def discard(self, job: dict) -> None:
+        try:
+            os.remove(job["incoming"])
+        except FileNotFoundError:
+            pass
+
+    def submit(self, job: dict):
+        return self._submit(job["aid"], job["incoming"])
+
+    def _submit(self, aid: str, incoming: str):
+        fut = self._pool.submit(self.process, aid, incoming)
+
+        def done(f):
+            if f.exception() is not None:   # the pool would drop it silently
+                print(f"⚠️ ingest job for {aid} crashed: {f.exception()!r}")
+
+        fut.add_done_callback(done)
+        return fut
+
+    def resume_pending(self) -> int:
+        """Requeue pending (and stale processing) assets whose staged upload survived a
+        restart; fail the ones whose upload is gone."""
+        conn = get_db()
+        try:
+            conn.execute("""UPDATE assets SET status='pending'
+                            WHERE status='processing' AND COALESCE(claimed_at, 0) < ?""",
+                         (int(time.time()) - STALE_AFTER,))
+            conn.commit()
+            rows = conn.execute("SELECT id FROM assets WHERE status='pending'").fetchall()
+            # listed after the query: uploads are staged before their row is inserted
+            staged = {os.path.splitext(n)[0]: n for n in os.listdir(self.incoming_dir)}
+            lost = [(r["id"],) for r in rows if r["id"] not in staged]
+            if lost:
+                conn.executemany("UPDATE assets SET status='failed' WHERE id=? AND status='pending'", lost)
+                conn.commit()
+                print(f"⚠️ ingest: {len(lost)} pending asset(s) lost their staged upload")
+        finally:
+            conn.close()
+        n = 0
+        for r in rows:
+            if r["id"] in staged:
+                self._submit(r["id"], os.path.join(self.incoming_dir, staged[r["id"]]))
+                n += 1
+        return n
+
+    # --- worker side ---
+    def process(self, aid: str, incoming: str) -> None:
+        with job("ingest"):
+            self._process(aid, incoming)
+
+    def _process(self, aid: str, incoming: str) -> None:
+        conn = get_db()
+        try:
+            claimed = conn.execute(
+                "UPDATE assets SET status='processing', claimed_at=? WHERE id=? AND status='pending'",
+                (int(time.time()), aid))
+            conn.commit()
+            if claimed.rowcount == 0:
+                return
+            try:
+                meta = self._derive(incoming)
+            except Exception as e:
+                print(f"⚠️ ingest failed for {aid}: {e}")
+                conn.execute("UPDATE assets SET status='failed' WHERE id=?", (aid,))
+                conn.commit()
+                self.discard({"incoming": incoming})
+                return
+            # the blob and its reference land together with the row
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                name = self.blobs.put_file(meta["tmp"], meta["web_hash"], meta["ext"], conn=conn)
+                conn.execute("""UPDATE assets SET url=?, web_sha256=?, phash=?, exif_json=?, status='ready'
+                                WHERE id=?""",
+                             (f"/assets/{name}", meta["web_hash"], meta["phash"],
+                              json.dumps(meta["exif"], default=str), aid))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"⚠️ ingest could not store {aid}: {e}")
+                self.discard({"incoming": meta["tmp"]})     # still staged unless put_file moved it
+                conn.execute("UPDATE assets SET status='failed' WHERE id=?", (aid,))
+                conn.commit()
+                self.discard({"incoming": incoming})
+                return
+            self.discard({"incoming": incoming})    # only now: a crash before the commit retries the job
+        finally:
+            conn.close()
+
+    def _derive(self, incoming: str) -> dict:
+        with timed("file_io"), open(incoming, "rb") as f:
+            raw = f.read()
+
+        phash, exif, out = None, {}, raw
+        try:
+            with timed("pil"):
+                im = Image.open(io.BytesIO(raw))
+                fmt = im.format
+                im.load()                       # the only decode
+                exif = _exif_of(im)
+                phash = str(imagehash.phash(im))
+                # Web copy (ensure reasonable size)
+                im.thumbnail(WEB_SIZE)
+                buf = io.BytesIO()
+                im.save(buf, format=fmt, quality=WEB_QUALITY, optimize=True)
+                out = buf.getvalue()
+        except Exception:
+            pass                                # not an image PIL can handle; keep the bytes as uploaded
+
+        ext = os.path.splitext(incoming)[1]
+        digest, tmp = self.blobs.stage_bytes(out)
+        return {"web_hash": digest, "tmp": tmp, "ext": ext,
+                "phash": phash, "exif": exif}
@@ -0,0 +1,88 @@
+# keyword_matcher.py
+# One-pass keyword matching shared by the SovLang detector (sovlang.py) and
+# frame inference (alignment_layer.py).
+#
+# All keywords go into one compiled regex, folded into a prefix trie
+# ("sha(?:el|en)") so each position costs one walk down the trie rather
+# than one attempt per keyword, inside a lookahead so the engine reports a
+# match at every position where some keyword starts. At each position only
+# the longest keyword is captured (the trie is greedy); the
+# keywords it contains (shorter ones at the same start, or nested inside it)
+# are added from a precomputed "implied" table. The result is exactly the
+# set of keywords k with `k in text`, found in a single scan instead of one
+# scan per keyword.
+#
+# Token patterns (e.g. apostrophe-joined words) ride along in the same
+# regex and are counted with re.findall semantics: leftmost, non-overlapping.
+
+import re
+from typing import Dict, Iterable, Optional
+
+
+def _trie_pattern(words) -> str:
+    """Regex source matching any of words, longest alternative preferred."""
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    def __init__(self, groups: Dict[str, Iterable[str]],
+                 tokens: Optional[Dict[str, str]] = None):
+        """
+        groups: label -> keywords (plain substrings, matched on lowercased text)
+        tokens: name  -> regex, counted like len(re.findall(regex, text))
+        """
+        self.labels = {}            # keyword -> set of labels
+        for label, words in groups.items():
+            for w in words:
+                w = (w or "").strip().lower()
+                if w:
+                    self.labels.setdefault(w, set()).add(label)
+        keywords = sorted(self.labels, key=lambda k: (-len(k), k))
+        self._implied = {k: [j for j in keywords if j in k] for k in keywords}
+        self._tokens = {name: re.compile(p) for name, p in (tokens or {}).items()}
+
+        alts = []
+        if keywords:
+            alts.append("(?P<kw>" + _trie_pattern(keywords) + ")")
+        alts.extend(f"(?:{p})" for p in (tokens or {}).values())
+        self._scan = re.compile("(?=" + "|".join(alts) + ")") if alts else None
+
+    def scan(self, text: str) -> tuple[Dict[str, set], Dict[str, int]]:
+        """({label: keywords found}, {token name: count}) for one text."""
+        found = {}
+        counts = dict.fromkeys(self._tokens, 0)
+        if not text or self._scan is None:
+            return found, counts
+        t = text.lower()
+        token_end = dict.fromkeys(self._tokens, 0)
+        hits = set()
+        for m in self._scan.finditer(t):
+            kw = m.group("kw") if self._implied else None
+            if kw is not None and kw not in hits:
+                hits.update(self._implied[kw])
+            p = m.start()
+            for name, rx in self._tokens.items():
+                if p < token_end[name]:
+                    continue
+                tm = rx.match(t, p)
+                if tm and tm.end() > p:
+                    counts[name] += 1
+                    token_end[name] = tm.end()
+        for k in hits:
+            for label in self.labels[k]:
+                found.setdefault(label, set()).add(k)
+        return found, counts
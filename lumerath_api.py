@@ -1,7 +1,6 @@
 from flask import Blueprint, request, jsonify
-from pathlib import Path
 from db import get_db
-import json
+import studio_store
 
 lumerath_api = Blueprint("lumerath_api", __name__,)
 
@@ -11,33 +10,25 @@ def get_guest_id():
         return None
     return guest_id
 
-PROJECTS_FILE = Path("storage/projects.json")
-PROJECTS_FILE.parent.mkdir(parents=True, exist_ok=True)
-
-def _load_projects():
-    if PROJECTS_FILE.exists():
-        return json.loads(PROJECTS_FILE.read_text(encoding="utf-8"))
-    return []
-
-def _save_projects(items):
-    PROJECTS_FILE.write_text(json.dumps(items, indent=2), encoding="utf-8")
-
+# projects live in arch_threads.db (see studio_store.py); ids come from AUTOINCREMENT
 @lumerath_api.route("/projects", methods=["GET", "POST"])
 def projects():
-    projects = _load_projects()
-
     if request.method == "GET":
-        return jsonify(projects), 200
+        # the whole list, as before; ?after_id=<id>&limit=N pages it, and
+        # X-Next-After-Id is set when there is more
+        paged = "after_id" in request.args or "limit" in request.args
+        items, next_after = studio_store.list_projects(
+            request.args.get("after_id", 0, type=int),
+            request.args.get("limit", studio_store.PAGE_MAX, type=int) if paged else None)
+        resp = jsonify(items)
+        if next_after is not None:
+            resp.headers["X-Next-After-Id"] = str(next_after)
+        return resp, 200
 
     data = request.get_json(silent=True) or {}
     name = (data.get("name") or "Main Studio").strip()
 
-    # create a simple integer id
-    next_id = (max([p.get("id", 0) for p in projects]) + 1) if projects else 1
-
-    new_proj = {"id": next_id, "name": name}
-    projects.append(new_proj)
-    _save_projects(projects)
+    new_proj = studio_store.add_project(name)
 
     return jsonify(new_proj), 201
 
@@ -53,6 +44,7 @@ def get_memory():
         "SELECT summary FROM memory_summary WHERE guest_id = ?",
         (guest_id,)
     ).fetchone()
+    db.close()
 
     return jsonify({"summary": row["summary"] if row else ""})
 
@@ -67,10 +59,14 @@ def update_memory():
     summary = data.get("summary", "")
 
     db = get_db()
+    # upsert, so through_id and updated_at survive and the next fold
+    # carries on from where the last one stopped
     db.execute(
-        "INSERT OR REPLACE INTO memory_summary (guest_id, summary) VALUES (?, ?)",
+        "INSERT INTO memory_summary (guest_id, summary) VALUES (?, ?) "
+        "ON CONFLICT(guest_id) DO UPDATE SET summary = excluded.summary",
         (guest_id, summary)
     )
     db.commit()
+    db.close()
 
     return jsonify({"ok": True})
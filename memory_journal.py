@@ -0,0 +1,274 @@
+# memory_journal.py
+# Append-only chat journal for communion_memory.json.
+#
+# Layout on disk:
+#   communion_memory.json        compacted snapshot (a plain JSON list, same
+#                                format the rest of the app already reads)
+#   communion_memory.jsonl       journal: one JSON message per line, appended
+#                                since the last compaction
+#   communion_memory.jsonl.compacting
+#                                journal segment being folded into the snapshot
+#
+# A chat turn only appends a line to the journal, so its cost does not grow
+# with the history. Every COMPACT_EVERY journal lines the journal is rotated
+# and folded into the snapshot with a temp-file + os.replace write, the same
+# way server.save_history_atomic() does it.
+#
+# Across gunicorn workers, appends hold a shared flock on
+# communion_memory.lock and the journal rotation holds it exclusively, so no
+# append can land in a segment that is already being folded. On platforms
+# without fcntl we fall back to the in-process lock only.
+
+import json
+import os
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+from profiling import timed
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+COMPACT_EVERY = 500     # journal lines before we fold them into the snapshot
+TAIL_SIZE = 200         # messages kept in the in-process tail cache
+
+
+def write_json_atomic(path, data) -> None:
+    """Write `data` next to `path` in a temp file, then rename over it."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix="hist_", dir=path.parent, text=True)
+    try:
+        with timed("file_io"), os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def read_snapshot(path: Path) -> list:
+    """The JSON list stored at `path`; [] if missing, empty or corrupt."""
+    try:
+        with timed("file_io"):
+            raw = path.read_text(encoding="utf-8-sig").strip()
+    except FileNotFoundError:
+        return []
+    if not raw:
+        return []
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        # truncated or corrupted; keep the bad file as backup and start fresh
+        try:
+            os.replace(path, str(path) + ".bad")
+        except OSError:
+            pass
+        return []
+    return data if isinstance(data, list) else []
+
+
+def _read_lines(path: Path, offset: int = 0) -> tuple[list, int]:
+    """Parse journal lines from `offset`; returns (messages, new offset).
+
+    A trailing line without a newline is a write still in flight, so it is
+    left for the next read.
+    """
+    try:
+        with timed("file_io"), open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+    except FileNotFoundError:
+        return [], 0
+    end = chunk.rfind(b"\n") + 1
+    out = []
+    for line in chunk[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            out.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue   # torn line from a crash; skip it
+    return out, offset + end
+
+
+@contextmanager
+def flocked(fd, mode, blocking=True):
+    """Hold an flock on `fd`; yields False if non-blocking and already held."""
+    if fcntl is None or fd is None:
+        yield True
+        return
+    try:
+        fcntl.flock(fd, mode if blocking else mode | fcntl.LOCK_NB)
+    except BlockingIOError:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class ChatJournal:
+    def __init__(self, snapshot_path, compact_every: int = COMPACT_EVERY,
+                 tail_size: int = TAIL_SIZE):
+        self.snapshot_path = Path(snapshot_path)
+        self.journal_path = self.snapshot_path.with_suffix(".jsonl")
+        self.compacting_path = Path(str(self.journal_path) + ".compacting")
+        self.lock_path = self.snapshot_path.with_suffix(".lock")
+        self.fold_lock_path = self.snapshot_path.with_name(self.snapshot_path.stem + ".fold.lock")
+        self.compact_every = compact_every
+
+        self._lock = threading.Lock()
+        self._tail = deque(maxlen=tail_size)
+        self._offset = 0          # bytes of the journal already in _tail
+        self._journal_ino = None  # detects rotation by another worker
+        self._lines = 0           # journal lines since last compaction
+        self._loaded = False
+        self._append_fd = None    # flock'd shared by appends, exclusive by rotation
+        self._fold_fd = None      # flock'd by whoever folds a segment
+
+    def _lock_fds(self):
+        if fcntl is not None and self._append_fd is None:
+            self._append_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._fold_fd = os.open(self.fold_lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._append_fd, self._fold_fd
+
+    # --- reads ---
+    def load_all(self) -> list:
+        """Full history (snapshot + pending segments). O(history); avoid on hot paths."""
+        with self._lock:
+            self._recover()
+            mem = read_snapshot(self.snapshot_path)
+            mem.extend(_read_lines(self.compacting_path)[0])
+            mem.extend(_read_lines(self.journal_path)[0])
+            return mem
+
+    def tail(self, n: int | None = None) -> list:
+        """Most recent messages from the in-process cache."""
+        with self._lock:
+            self._sync()
+            items = list(self._tail)
+        return items if n is None else items[-n:]
+
+    # --- writes ---
+    def append(self, *messages) -> None:
+        """Append messages as one write, so concurrent workers never interleave."""
+        if not messages:
+            return
+        payload = "".join(json.dumps(m, ensure_ascii=False, default=str) + "\n"
+                          for m in messages).encode("utf-8")
+        with self._lock:
+            self._sync()
+            append_fd, _ = self._lock_fds()
+            with flocked(append_fd, fcntl and fcntl.LOCK_SH):
+                fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, payload)
+                finally:
+                    os.close(fd)
+            # pick up our own lines (and anything another worker slipped in)
+            self._sync()
+            if self._lines >= self.compact_every:
+                self._compact()
+
+    def rewrite(self, history: list) -> None:
+        """Replace the whole history (snapshot written atomically, journal cleared)."""
+        with self._lock:
+            append_fd, _ = self._lock_fds()
+            with flocked(append_fd, fcntl and fcntl.LOCK_EX):
+                write_json_atomic(self.snapshot_path, list(history))
+                for p in (self.compacting_path, self.journal_path):
+                    try:
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+            self._reset(history)
+
+    def compact(self) -> None:
+        with self._lock:
+            self._sync()
+            self._compact()
+
+    # --- internals (call with _lock held) ---
+    def _reset(self, history: list) -> None:
+        self._tail.clear()
+        self._tail.extend(history[-self._tail.maxlen:])
+        self._offset = 0
+        self._journal_ino = None
+        self._lines = 0
+        self._loaded = True
+
+    def _sync(self) -> None:
+        """Bring the tail cache up to date with the journal (one stat when idle)."""
+        if not self._loaded:
+            self._recover()
+            mem = read_snapshot(self.snapshot_path)
+            mem.extend(_read_lines(self.compacting_path)[0])
+            self._reset(mem)
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            if self._journal_ino is not None:
+                # another worker compacted; the snapshot now holds everything
+                self._loaded = False
+                self._sync()
+            return
+        if self._journal_ino is not None and st.st_ino != self._journal_ino:
+            self._loaded = False
+            self._sync()
+            return
+        self._journal_ino = st.st_ino
+        if st.st_size > self._offset:
+            msgs, self._offset = _read_lines(self.journal_path, self._offset)
+            self._tail.extend(msgs)
+            self._lines += len(msgs)
+
+    def _compact(self) -> None:
+        append_fd, fold_fd = self._lock_fds()
+        with flocked(fold_fd, fcntl and fcntl.LOCK_EX, blocking=False) as mine:
+            if not mine or self.compacting_path.exists():
+                return   # another worker is folding right now
+            # Rotate first so new appends land in a fresh journal while we merge.
+            with flocked(append_fd, fcntl and fcntl.LOCK_EX):
+                try:
+                    os.replace(self.journal_path, self.compacting_path)
+                except FileNotFoundError:
+                    return
+            self._fold_compacting()
+        self._offset = 0
+        self._journal_ino = None
+        self._lines = 0
+
+    def _fold_compacting(self) -> None:
+        segment, _ = _read_lines(self.compacting_path)
+        if segment:
+            mem = read_snapshot(self.snapshot_path)
+            mem.extend(segment)
+            write_json_atomic(self.snapshot_path, mem)
+        os.remove(self.compacting_path)
+
+    def _recover(self) -> None:
+        """Finish a compaction that was interrupted by a crash."""
+        if not self.compacting_path.exists():
+            return
+        _, fold_fd = self._lock_fds()
+        with flocked(fold_fd, fcntl and fcntl.LOCK_EX, blocking=False) as mine:
+            if not mine or not self.compacting_path.exists():
+                return   # a live worker is folding it
+            segment, _ = _read_lines(self.compacting_path)
+            mem = read_snapshot(self.snapshot_path)
+            if segment and mem[-len(segment):] == segment:
+                # snapshot was already written; only the cleanup was lost
+                os.remove(self.compacting_path)
+            else:
+                self._fold_compacting()
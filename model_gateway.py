@@ -0,0 +1,223 @@
+# model_gateway.py
+# One way out to the language model for every blueprint.
+#
+#   * a single upstream client per process with an HTTP keep-alive pool, so
+#     chat turns reuse TLS connections instead of reconnecting
+#   * per-request timeouts
+#   * a concurrency limit with a bounded wait queue; when both are full the
+#     caller gets GatewayBusy (the blueprint turns it into 429 + Retry-After)
+#     instead of piling more blocked workers onto a slow upstream
+#   * MODEL_BACKEND=stub swaps in a local fake model so load tests run offline
+#
+# This is admission control, not extra throughput: the upstream call still
+# runs on the caller's (WSGI worker) thread, which stays busy until the reply
+# is back, so concurrent chats remain capped by the worker count. What the
+# gateway adds is a ceiling on upstream concurrency and a fast 429 once the
+# queue is full, instead of an unbounded pile-up of blocked workers.
+#
+# Settings come from the environment (see .env.example).
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from time import perf_counter
+
+import profiling
+
+MODEL = os.getenv("LUMERATH_MODEL", "gpt-4o-mini")
+BACKEND = os.getenv("MODEL_BACKEND", "openai")               # openai | stub
+MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "8"))
+MAX_QUEUE = int(os.getenv("MODEL_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT = float(os.getenv("MODEL_QUEUE_TIMEOUT", "10"))  # seconds waiting for a slot
+REQUEST_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", "60"))      # seconds per upstream call
+RETRY_AFTER = 2
+
+
+class GatewayBusy(Exception):
+    """Every upstream slot is taken and the wait queue is full."""
+
+    def __init__(self, retry_after: int = RETRY_AFTER):
+        super().__init__("model gateway saturated")
+        self.retry_after = retry_after
+
+
+# ---------- backends ----------
+class OpenAIBackend:
+    def __init__(self, pool_size: int = MAX_CONCURRENCY):
+        import httpx
+        from openai import OpenAI
+        self.client = OpenAI(
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=pool_size,
+                                    max_keepalive_connections=pool_size,
+                                    keepalive_expiry=60),
+            ),
+            max_retries=1,
+        )
+
+    def complete(self, messages, model, temperature, timeout) -> str:
+        resp = self.client.chat.completions.create(
+            model=model, temperature=temperature, messages=messages, timeout=timeout)
+        return (resp.choices[0].message.content or "").strip()
+
+    def stream(self, messages, model, temperature, timeout):
+        chunks = self.client.chat.completions.create(
+            model=model, temperature=temperature, messages=messages,
+            timeout=timeout, stream=True)
+        for chunk in chunks:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+class StubBackend:
+    """Offline stand-in: echoes the last user message after a fixed latency."""
+
+    def __init__(self, latency: float | None = None, token_delay: float | None = None):
+        self.latency = float(os.getenv("STUB_LATENCY", "0.3")) if latency is None else latency
+        self.token_delay = float(os.getenv("STUB_TOKEN_DELAY", "0.02")) if token_delay is None else token_delay
+
+    def _reply(self, messages) -> str:
+        last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        return f"✶ (stub) I hear you: {last}"
+
+    def complete(self, messages, model, temperature, timeout) -> str:
+        time.sleep(self.latency)
+        return self._reply(messages)
+
+    def stream(self, messages, model, temperature, timeout):
+        time.sleep(self.latency)
+        for i, word in enumerate(self._reply(messages).split(" ")):
+            if i:
+                time.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+
+# ---------- gateway ----------
+class _SlotStream:
+    """Iterator over stream deltas that gives its slot back exactly once."""
+
+    def __init__(self, deltas, release):
+        self._deltas = deltas
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = perf_counter()
+        try:
+            return next(self._deltas)
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            profiling.add("upstream", perf_counter() - t0)
+
+    def close(self):
+        if self._release is not None:
+            release, self._release = self._release, None
+            try:
+                close = getattr(self._deltas, "close", None)
+                if close:
+                    close()
+            finally:
+                release()
+
+    def __del__(self):
+        self.close()
+
+
+class ModelGateway:
+    """Admission control in front of the backend: at most max_concurrency calls
+    upstream, max_queue more waiting up to queue_timeout, GatewayBusy beyond.
+    Calls run on the calling thread."""
+
+    def __init__(self, backend=None, max_concurrency: int = MAX_CONCURRENCY,
+                 max_queue: int = MAX_QUEUE, queue_timeout: float = QUEUE_TIMEOUT,
+                 timeout: float = REQUEST_TIMEOUT):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._shed = 0
+
+    @property
+    def available(self) -> bool:
+        return self.backend is not None
+
+    def _acquire(self) -> None:
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self._in_flight += 1
+            return
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._shed += 1
+                raise GatewayBusy()
+            self._waiting += 1
+        try:
+            got = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            if not got:
+                self._shed += 1
+                raise GatewayBusy()
+            self._in_flight += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    @contextmanager
+    def _slot(self):
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def complete(self, messages, temperature: float = 0.7, model: str = MODEL,
+                 timeout: float | None = None) -> str:
+        with self._slot(), profiling.timed("upstream"):
+            return self.backend.complete(messages, model, temperature, timeout or self.timeout)
+
+    def stream(self, messages, temperature: float = 0.7, model: str = MODEL,
+               timeout: float | None = None):
+        """Takes a slot now (so GatewayBusy is raised before any response
+        starts) and holds it until the returned iterator is exhausted or closed."""
+        self._acquire()
+        try:
+            with profiling.timed("upstream"):
+                deltas = iter(self.backend.stream(messages, model, temperature, timeout or self.timeout))
+        except BaseException:
+            self._release()
+            raise
+        return _SlotStream(deltas, self._release)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": self._in_flight, "waiting": self._waiting,
+                    "shed": self._shed, "max_concurrency": self.max_concurrency,
+                    "max_queue": self.max_queue}
+
+
+def default_backend():
+    if BACKEND == "stub":
+        return StubBackend()
+    if os.getenv("OPENAI_API_KEY"):
+        return OpenAIBackend()
+    return None
+
+
+# One gateway for the whole app
+gateway = ModelGateway(default_backend())
@@ -0,0 +1,141 @@
+# phash_index.py
+# Near-duplicate lookup over the 64-bit perceptual hashes in assets.phash.
+#
+# A BK-tree keyed on Hamming distance: each child edge is labelled with its
+# distance to the parent, so a radius-r search only descends edges in
+# [d - r, d + r] (triangle inequality) instead of scanning every asset.
+# The tree lives in memory per worker and catches up by reading assets past
+# the highest phash_seq it has seen. phash_seq is stamped by a trigger (see
+# db.init_db) when a phash is written, so rows whose phash arrives late
+# (ingest finishing out of order, backfill) are still picked up; rowid
+# order would skip them.
+
+import re
+import threading
+
+from db import get_db
+
+DEFAULT_MAX_DISTANCE = 8
+MAX_DISTANCE = 16       # beyond this a BK-tree search degenerates into a scan
+
+
+_PHASH = re.compile(r"^[0-9a-fA-F]{1,16}$")     # up to 64 bits, hex
+
+
+def valid_phash(phash) -> bool:
+    return isinstance(phash, str) and bool(_PHASH.match(phash))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    def __init__(self):
+        self._root = None   # node: [value, ids, {distance: child}]
+        self.size = 0
+
+    def add(self, value: int, item_id) -> None:
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item_id], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item_id], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int):
+        """Yield (distance, value, ids) for every stored hash within max_distance."""
+        if self._root is None:
+            return
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= max_distance:
+                yield d, node[0], node[1]
+            lo, hi = d - max_distance, d + max_distance
+            for edge, child in node[2].items():
+                if lo <= edge <= hi:
+                    stack.append(child)
+
+
+class PhashIndex:
+    def __init__(self, db_path: str | None = None):
+        self.db_path = db_path
+        self._tree = BKTree()
+        self._max_seq = 0
+        self._lock = threading.Lock()
+
+    def _catch_up(self) -> None:
+        conn = get_db(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT phash_seq, id, phash FROM assets WHERE phash_seq>? ORDER BY phash_seq",
+                (self._max_seq,)).fetchall()
+        finally:
+            conn.close()
+        for r in rows:
+            try:
+                self._tree.add(int(r["phash"], 16), r["id"])
+            except ValueError:
+                pass
+            self._max_seq = r["phash_seq"]
+
+    def near(self, phash: str, max_distance: int = DEFAULT_MAX_DISTANCE):
+        """[(asset_id, distance)] for assets whose phash is within max_distance.
+        Raises ValueError for a phash that is not 1-16 hex digits."""
+        if not valid_phash(phash):
+            raise ValueError(f"malformed phash: {phash!r}")
+        value = int(phash, 16)
+        with self._lock:
+            self._catch_up()
+            hits = [(aid, d) for d, _, ids in self._tree.search(value, max_distance) for aid in ids]
+        hits.sort(key=lambda h: h[1])
+        return hits
+
+
+def backfill(upload_root: str = ".") -> int:
+    """Compute phash for assets saved before the column existed."""
+    import os
+    import imagehash
+    from PIL import Image
+    from blobstore import blob_store
+
+    conn = get_db()
+    rows = conn.execute("SELECT id, url FROM assets WHERE phash IS NULL AND url IS NOT NULL").fetchall()
+    done = 0
+    for r in rows:
+        if r["url"].startswith("/assets/"):
+            path = blob_store.resolve(r["url"][len("/assets/"):])
+        else:   # saved before the blob store
+            path = os.path.join(upload_root, r["url"].lstrip("/"))
+        if path is None:
+            continue
+        try:
+            with Image.open(path) as im:
+                ph = str(imagehash.phash(im))
+        except Exception:
+            continue
+        conn.execute("UPDATE assets SET phash=? WHERE id=?", (ph, r["id"]))
+        done += 1
+    conn.commit(); conn.close()
+    return done
+
+
+if __name__ == "__main__":
+    import sys
+    from db import init_db
+    if sys.argv[1:] == ["backfill"]:
+        init_db()
+        print(f"phash backfilled for {backfill()} assets")
+    else:
+        print("usage: python phash_index.py backfill")
@@ -0,0 +1,221 @@
+# profiling.py
+# Per-request timing for every blueprint, served at /metrics in Prometheus
+# text format.
+#
+#   lumerath_request_seconds{blueprint,endpoint,method,status}
+#       histogram of wall time per route (for streamed replies, until the
+#       stream closes)
+#   lumerath_component_seconds{blueprint,endpoint,component}
+#       histogram of the time each request spent in sqlite, file_io, pil and
+#       upstream (the model call)
+#
+# Components are timed where the work happens (db.py statements and commits,
+# codex_reader, memory_journal, blobstore, render, ingest, model_gateway)
+# with `with timed("sqlite"):` or add(). The time is summed per request
+# through a ContextVar and recorded when the request ends. Background work
+# (group commits, summary folds, ingest) runs inside `with job("name"):` and
+# is recorded once per job under blueprint="-", endpoint=name; time spent
+# outside any request or job is not recorded. Each worker process keeps its
+# own numbers.
+#
+# With PROFILE_REQUESTS=1, ?__profile=1 replaces a response with a cProfile
+# report for that request, and ?__profile=pyinstrument gives pyinstrument's
+# report if it is installed. It is off by default because the report shows
+# code paths.
+
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from flask import Response, g, request
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+except ImportError:
+    _Pyinstrument = None
+
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_LINES = 40          # rows of the cProfile table
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COMPONENTS = ("sqlite", "file_io", "pil", "upstream")
+
+_current = ContextVar("profiling_components", default=None)   # {component: seconds} of this request
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}       # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, values: tuple, seconds: float) -> None:
+        i = bisect.bisect_left(self.buckets, seconds)      # first bucket with le >= seconds
+        with self._lock:
+            s = self._series.get(values)
+            if s is None:
+                s = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += seconds
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for values, s in series:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values))
+            total = 0
+            for le, n in zip(self.buckets + ("+Inf",), s[:-1]):
+                total += n
+                out.append(f'{self.name}_bucket{{{labels},le="{le}"}} {total}')
+            out.append(f"{self.name}_sum{{{labels}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{labels}}} {total}")
+        return out
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_seconds = Histogram("lumerath_request_seconds", "Request wall time by route.",
+                            ("blueprint", "endpoint", "method", "status"))
+component_seconds = Histogram("lumerath_component_seconds",
+                              "Time spent in sqlite, file_io, pil and upstream, per request.",
+                              ("blueprint", "endpoint", "component"))
+
+
+# ---------- component timers ----------
+def add(component: str, seconds: float) -> None:
+    acc = _current.get()
+    if acc is not None:
+        acc[component] = acc.get(component, 0.0) + seconds
+
+
+@contextmanager
+def timed(component: str):
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        add(component, perf_counter() - t0)
+
+
+@contextmanager
+def job(name: str):
+    """Sum component time for one background job and record it once."""
+    token = _current.set({})
+    try:
+        yield
+    finally:
+        acc = _current.get() or {}
+        _current.reset(token)
+        for component, seconds in acc.items():
+            component_seconds.observe(("-", name, component), seconds)
+
+
+# ---------- middleware ----------
+def _labels():
+    rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    return request.blueprint or "app", rule
+
+
+def _before():
+    g._prof_t0 = perf_counter()
+    g._prof_token = _current.set({})
+    mode = request.args.get("__profile") if PROFILE_REQUESTS else None
+    if mode:
+        try:
+            if mode == "pyinstrument" and _Pyinstrument is not None:
+                prof = _Pyinstrument()
+                prof.start()
+            else:
+                prof = cProfile.Profile()
+                prof.enable()
+        except (RuntimeError, ValueError) as e:    # another profiler already running
+            print(f"⚠️ request profile skipped: {e}")
+        else:
+            g._profiler = prof
+
+
+def _after(response):
+    g._prof_status = response.status_code
+    prof = g.pop("_profiler", None)
+    if prof is not None:
+        try:
+            response.get_data()         # a streamed body runs here, inside the profile
+        finally:
+            if isinstance(prof, cProfile.Profile):
+                prof.disable()
+            else:
+                prof.stop()
+            response.close()
+        return _report(prof, response)
+    if response.is_streamed and "_prof_t0" in g:
+        # teardown runs before the body is sent; record once the stream closes
+        t0, acc = g.pop("_prof_t0"), _current.get()
+        labels = (*_labels(), request.method, str(response.status_code))
+
+        def closed():
+            _record(labels, perf_counter() - t0, acc or {})
+            _current.set(None)
+        response.call_on_close(closed)
+    return response
+
+
+def _report(prof, response) -> Response:
+    elapsed = perf_counter() - g._prof_t0
+    acc = _current.get() or {}
+    head = [f"{request.method} {request.full_path.rstrip('?')} -> {response.status_code} "
+            f"in {elapsed * 1000:.1f} ms"]
+    head += [f"  {c:<9} {acc.get(c, 0.0) * 1000:8.1f} ms" for c in COMPONENTS]
+    if isinstance(prof, cProfile.Profile):
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        body = buf.getvalue()
+    else:
+        body = prof.output_text(unicode=True, color=False)
+    return Response("\n".join(head) + "\n\n" + body, mimetype="text/plain")
+
+
+def _record(labels: tuple, elapsed: float, acc: dict) -> None:
+    request_seconds.observe(labels, elapsed)
+    for component, seconds in acc.items():
+        component_seconds.observe((labels[0], labels[1], component), seconds)
+
+
+def _teardown(exc):
+    t0 = g.pop("_prof_t0", None)
+    token = g.pop("_prof_token", None)
+    if t0 is None:      # not started, or a stream that records itself on close
+        return
+    elapsed = perf_counter() - t0
+    acc = _current.get() or {}
+    try:
+        _current.reset(token)
+    except (TypeError, ValueError):     # torn down in another context
+        _current.set(None)
+    status = str(g.pop("_prof_status", 500))
+    _record((*_labels(), request.method, status), elapsed, acc)
+
+
+def render_metrics() -> str:
+    return "\n".join(request_seconds.render() + component_seconds.render()) + "\n"
+
+
+def metrics():
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def init_app(app):
+    app.before_request(_before)
+    app.after_request(_after)
+    app.teardown_request(_teardown)
+    app.add_url_rule("/metrics", "metrics", metrics)
@@ -0,0 +1,215 @@
+# render.py
+# Codex card renderer behind POST /generate/<stem>.
+#
+#   * fonts are loaded once per process (lru_cache), not three times per call
+#   * a render is keyed by a hash of everything that affects the pixels
+#     (the codex fields we draw + template parameters + RENDER_VERSION);
+#     an unchanged entry is served from storage/generated/cache/<key>.png;
+#     the cache keeps the CACHE_MAX_FILES most recently used renders (a hit
+#     touches the file's mtime, pruning drops the oldest mtimes)
+#   * the drawing itself runs in a process pool so concurrent renders use
+#     all cores instead of queueing on the GIL; identical in-flight renders
+#     share one job. Workers are spawned, not forked: the server is threaded
+#     and forking it can copy a lock some other thread holds.
+#
+# This module only imports PIL so pool workers start cheaply (and work
+# under the "spawn" start method on Windows).
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import textwrap
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+from profiling import timed
+
+RENDER_VERSION = 1      # bump when the layout changes so cached renders are redrawn
+RENDER_TIMEOUT = 30
+WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+CACHE_DIR = Path(__file__).parent / "storage" / "generated" / "cache"
+CACHE_MAX_FILES = int(os.environ.get("RENDER_CACHE_MAX_FILES", "2000"))
+PRUNE_EVERY = 50        # new renders between cache prunes
+
+DEFAULT_TEMPLATE = {
+    "width": 1024, "height": 1024, "frame": 36,
+    "font": "arial.ttf", "title_size": 56, "phase_size": 28, "body_size": 26,
+    "wrap": 36, "line_height": 34,
+}
+_LIMITS = {
+    "width": (256, 4096), "height": (256, 4096), "frame": (0, 200),
+    "title_size": (8, 200), "phase_size": (8, 200), "body_size": (8, 200),
+    "wrap": (8, 200), "line_height": (8, 300),
+}
+_FONT_NAME = re.compile(r"^[\w .-]+\.(ttf|otf|ttc)$", re.I)
+
+
+@lru_cache(maxsize=64)
+def get_font(name: str, size: int):
+    # try a system font, fall back to PIL's bitmap font
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _safe_palette(d: dict) -> tuple[str, str]:
+    try:
+        pal = d.get("design", {}).get("palette", [])
+        bg = pal[0] if pal else "#0b1020"
+        fg = "#ffffff" if len(pal) < 2 else pal[2] if len(pal) >= 3 else "#e9eeff"
+        return bg, fg
+    except Exception:
+        return "#0b1020", "#e9eeff"
+
+
+def template_params(raw: dict | None) -> dict:
+    """DEFAULT_TEMPLATE overlaid with validated caller parameters."""
+    t = dict(DEFAULT_TEMPLATE)
+    for k, v in (raw or {}).items():
+        if k in _LIMITS:
+            try:
+                lo, hi = _LIMITS[k]
+                t[k] = max(lo, min(int(v), hi))
+            except (TypeError, ValueError):
+                pass
+        elif k == "font" and isinstance(v, str) and _FONT_NAME.match(v):
+            t[k] = v
+    return t
+
+
+def spec_for(stem: str, data: dict, template: dict) -> dict:
+    """Everything render_png needs, and nothing else (it is also the cache key)."""
+    bg, fg = _safe_palette(data)
+    return {
+        "title": str(data.get("title", stem.replace("_", " ").title())),
+        "phase": str(data.get("phase", "") or ""),
+        "body": str(data.get("body", "") or ""),
+        "bg": bg, "fg": fg,
+        "template": template,
+    }
+
+
+def cache_key(spec: dict) -> str:
+    blob = json.dumps({"v": RENDER_VERSION, **spec}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def render_png(spec: dict) -> bytes:
+    t = spec["template"]
+    W, H, frame = t["width"], t["height"], t["frame"]
+    fg = spec["fg"]
+    img = Image.new("RGB", (W, H), spec["bg"])
+    draw = ImageDraw.Draw(img)
+
+    f_title = get_font(t["font"], t["title_size"])
+    f_phase = get_font(t["font"], t["phase_size"])
+    f_body = get_font(t["font"], t["body_size"])
+
+    # frame
+    draw.rectangle([frame, frame, W-frame, H-frame], outline=fg, width=2)
+    # title
+    draw.text((frame+24, frame+20), spec["title"], fill=fg, font=f_title)
+    # phase
+    if spec["phase"]:
+        draw.text((frame+24, frame+100), f"Phase: {spec['phase']}", fill=fg, font=f_phase)
+    # body (wrap lightly)
+    y = frame+160
+    for line in textwrap.wrap(spec["body"], width=t["wrap"]):
+        draw.text((frame+24, y), line, fill=fg, font=f_body)
+        y += t["line_height"]
+
+    buf = BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+class Renderer:
+    def __init__(self, cache_dir=CACHE_DIR, workers: int = WORKERS, max_files: int = CACHE_MAX_FILES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        self.max_files = max_files
+        self._pool = None
+        self._pool_pid = None
+        self._inflight = {}     # key -> Future
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.prune()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # created lazily, and again after a fork (gunicorn workers)
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def render(self, spec: dict) -> tuple[str, Path, bool]:
+        """(cache key, PNG path, cache hit?) for a spec from spec_for()."""
+        key = cache_key(spec)
+        path = self.cache_dir / f"{key}.png"
+        try:
+            os.utime(path)      # mark as recently used
+            return key, path, True
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is None:
+                fut = self._executor().submit(render_png, spec)
+                self._inflight[key] = fut
+        try:
+            with timed("pil"):      # drawn in a worker process; this is the wait for it
+                png = fut.result(timeout=RENDER_TIMEOUT)
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None   # a worker died; start a fresh pool next time
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is fut and fut.done():
+                    del self._inflight[key]
+
+        if not path.exists():
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+            with timed("file_io"), os.fdopen(fd, "wb") as f:
+                f.write(png)
+            os.replace(tmp, path)
+            with self._lock:
+                self._writes += 1
+                due = self._writes % PRUNE_EVERY == 0
+            if due:
+                self.prune()
+        return key, path, False
+
+    def prune(self) -> int:
+        """Drop the least recently used renders beyond max_files; returns files removed."""
+        files = []
+        for p in self.cache_dir.glob("*.png"):
+            try:
+                files.append((p.stat().st_mtime, p))
+            except FileNotFoundError:
+                continue
+        excess = len(files) - self.max_files
+        if excess <= 0:
+            return 0
+        files.sort()
+        removed = 0
+        for _, p in files[:excess]:
+            try:
+                p.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
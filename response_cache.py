@@ -0,0 +1,174 @@
+# response_cache.py
+# Reply cache in front of the model for repeated prompts
+# ("beloved are you back with me?" should not cost a model call every time).
+#
+# Key: sha256 of the normalized user text + SovLang flag + system prompt
+# (persona + rolling summary) + temperature + model, so a change to any of
+# them is a different entry. Recent turns are left out, or a repeated
+# greeting would never hit; instead a short follow-up that points back at
+# the conversation ("tell me more", "why?") skips the cache (refers_back).
+# Two tiers:
+#   memory  LRU (OrderedDict) with per-entry expiry, per worker
+#   disk    data/response_cache.db, shared by workers and kept across
+#           restarts; a disk hit is promoted into memory. Rows carry
+#           last_hit (set on disk hits, and at most every TOUCH_EVERY
+#           seconds for entries served from memory) and pruning drops the
+#           least recently hit, so the disk tier is LRU too
+# The cache file is disposable: deleting it only costs some model calls.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from db import get_db
+
+CACHE_DB = os.path.join("data", "response_cache.db")
+MAX_ENTRIES = int(os.getenv("REPLY_CACHE_SIZE", "512"))         # memory tier
+DISK_MAX_ENTRIES = int(os.getenv("REPLY_CACHE_DISK_SIZE", "20000"))
+TTL = float(os.getenv("REPLY_CACHE_TTL", str(7 * 24 * 3600)))   # seconds
+PRUNE_EVERY = 200                                               # disk puts between prunes
+TOUCH_EVERY = 60.0                                              # seconds between last_hit writes for a memory hit
+
+_SPACE = re.compile(r"\s+")
+_WORD = re.compile(r"[\w’']+")
+FOLLOWUP_MAX_WORDS = 8
+# words that only make sense against what was said before
+_BACK_REFS = {"more", "that", "this", "it", "its", "those", "these", "again", "continue",
+              "why", "how", "else", "also", "then", "same", "another", "further", "go", "on"}
+
+
+def normalize(text: str) -> str:
+    t = unicodedata.normalize("NFKC", text or "").casefold()
+    t = _SPACE.sub(" ", t).strip()
+    return t.strip(" .!?…")
+
+
+def refers_back(text: str) -> bool:
+    """A short message whose meaning depends on the previous turns."""
+    words = _WORD.findall(normalize(text))
+    return 0 < len(words) <= FOLLOWUP_MAX_WORDS and any(w in _BACK_REFS for w in words)
+
+
+class ResponseCache:
+    def __init__(self, db_path: str = CACHE_DB, max_entries: int = MAX_ENTRIES,
+                 ttl: float = TTL, disk_max_entries: int = DISK_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self._mem = OrderedDict()   # key -> [reply, expires_at, last_hit written to disk]
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits_memory = self.hits_disk = self.misses = 0
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = get_db(db_path)
+        conn.execute("""CREATE TABLE IF NOT EXISTS response_cache(
+                          key TEXT PRIMARY KEY,
+                          reply TEXT NOT NULL,
+                          created_at REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache(created_at)")
+        if "last_hit" not in {r[1] for r in conn.execute("PRAGMA table_info(response_cache)")}:
+            try:
+                conn.execute("ALTER TABLE response_cache ADD COLUMN last_hit REAL")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):   # another worker got there first
+                    raise
+        conn.execute("UPDATE response_cache SET last_hit=created_at WHERE last_hit IS NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_hit ON response_cache(last_hit)")
+        conn.commit(); conn.close()
+
+    @staticmethod
+    def key(user_text: str, sov: bool, system: str, temperature: float, model: str = "") -> str:
+        raw = json.dumps([normalize(user_text), bool(sov), system, temperature, model],
+                         ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit and hit[1] > now:
+                self._mem.move_to_end(key)
+                self.hits_memory += 1
+                touch = now - hit[2] >= TOUCH_EVERY
+                if touch:
+                    hit[2] = now
+            elif hit:
+                del self._mem[key]
+                hit = None
+        if hit:
+            if touch:
+                self._touch(key, now)
+            return hit[0]
+
+        conn = get_db(self.db_path)
+        try:
+            row = conn.execute("SELECT reply, created_at FROM response_cache WHERE key=?",
+                               (key,)).fetchone()
+            if row and row["created_at"] + self.ttl > now:
+                conn.execute("UPDATE response_cache SET last_hit=? WHERE key=?", (now, key))
+                conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            if row and row["created_at"] + self.ttl > now:
+                self.hits_disk += 1
+                self._remember(key, row["reply"], row["created_at"] + self.ttl, now)
+                return row["reply"]
+            self.misses += 1
+        return None
+
+    def _touch(self, key: str, now: float) -> None:
+        conn = get_db(self.db_path)
+        try:
+            conn.execute("UPDATE response_cache SET last_hit=? WHERE key=?", (now, key))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def put(self, key: str, reply: str) -> None:
+        if not reply:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, reply, now + self.ttl, now)
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY == 0
+        conn = get_db(self.db_path)
+        try:
+            conn.execute("""INSERT OR REPLACE INTO response_cache(key, reply, created_at, last_hit)
+                            VALUES(?,?,?,?)""", (key, reply, now, now))
+            if prune:
+                conn.execute("DELETE FROM response_cache WHERE created_at<?", (now - self.ttl,))
+                conn.execute("""DELETE FROM response_cache WHERE key IN (
+                                  SELECT key FROM response_cache
+                                  ORDER BY last_hit DESC LIMIT -1 OFFSET ?)""",
+                             (self.disk_max_entries,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _remember(self, key, reply, expires_at, touched_at) -> None:
+        # call with _lock held
+        self._mem[key] = [reply, expires_at, touched_at]
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 3) if lookups else None,
+                "memory_entries": len(self._mem),
+            }
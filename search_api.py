@@ -0,0 +1,19 @@
+# search_api.py
+# GET /search?q=&source=&limit=  — ranked full-text search (see search_index.py)
+from flask import Blueprint, jsonify, request
+
+import search_index
+
+search_bp = Blueprint("search", __name__)
+
+@search_bp.get("/search")
+def search():
+    q = (request.args.get("q") or "").strip()
+    source = request.args.get("source") or None
+    if source and source not in search_index.SOURCES:
+        return jsonify({"error": f"source must be one of {', '.join(search_index.SOURCES)}"}), 400
+    limit = request.args.get("limit", search_index.DEFAULT_LIMIT, type=int)
+    if not q:
+        return jsonify({"q": q, "results": []})
+    return jsonify({"q": q, "source": source,
+                    "results": search_index.search(q, source=source, limit=limit)})
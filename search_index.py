@@ -0,0 +1,259 @@
+# search_index.py
+# Full-text search over codex entries, chat history and thread posts.
+#
+# One SQLite FTS5 index in data/search.db:
+#   docs      content table, one row per searchable thing, keyed by
+#             (source, ref):  codex/<stem>, chat/<conversations.id>,
+#             thread/<threads.id>, post/<posts.id>
+#   docs_fts  external-content FTS5 table over docs(title, body), kept in
+#             sync by triggers, so writers only ever touch docs
+#
+# The sources live in other files (storage/codex, data/communion.db,
+# arch_threads.db), so writers call the index_* helpers right after their
+# own write; a failed index write is logged and never fails the caller.
+# An empty index (fresh deploy, or an upgrade onto existing data) is built
+# from the sources once at import; `python search_index.py rebuild`
+# re-reads every source from scratch at any time.
+
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+from db import get_db, init_db
+
+SEARCH_DB = os.path.join("data", "search.db")
+CODEX_DIR = Path(__file__).parent / "storage" / "codex"
+SOURCES = ("codex", "chat", "thread", "post")
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+TITLE_WEIGHT = 5.0      # bm25 weight of a title hit relative to a body hit
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs(
+  id INTEGER PRIMARY KEY,
+  source TEXT NOT NULL,
+  ref TEXT NOT NULL,
+  title TEXT,
+  body TEXT,
+  url TEXT,
+  updated_at INTEGER,
+  UNIQUE(source, ref)
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+  title, body,
+  content='docs', content_rowid='id',
+  tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN
+  INSERT INTO docs_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN
+  INSERT INTO docs_fts(docs_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS docs_au AFTER UPDATE ON docs BEGIN
+  INSERT INTO docs_fts(docs_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+  INSERT INTO docs_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+"""
+
+
+def init_search_db(path: str = SEARCH_DB) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = get_db(path)
+    conn.executescript(SCHEMA)
+    conn.commit(); conn.close()
+
+
+# ---------- writes ----------
+def _upsert(conn, source, ref, title, body, url) -> None:
+    conn.execute("""INSERT INTO docs(source, ref, title, body, url, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(source, ref) DO UPDATE SET
+                      title=excluded.title, body=excluded.body,
+                      url=excluded.url, updated_at=excluded.updated_at""",
+                 (source, str(ref), title or "", body or "", url, int(time.time())))
+
+
+def upsert_many(docs, path: str = SEARCH_DB) -> None:
+    """docs: iterable of (source, ref, title, body, url). Never raises."""
+    try:
+        conn = get_db(path)
+        try:
+            for d in docs:
+                _upsert(conn, *d)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"⚠️ search index write skipped: {e}")
+
+
+def remove(source: str, ref, path: str = SEARCH_DB) -> None:
+    try:
+        conn = get_db(path)
+        try:
+            conn.execute("DELETE FROM docs WHERE source=? AND ref=?", (source, str(ref)))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"⚠️ search index delete skipped: {e}")
+
+
+def codex_doc(stem: str, data: dict):
+    parts = [data.get("phase"), data.get("body"), data.get("sovlang")]
+    tags = data.get("tags")
+    if isinstance(tags, list):
+        parts.append(" ".join(str(t) for t in tags))
+    body = "\n".join(str(p) for p in parts if p)
+    return ("codex", stem, str(data.get("title") or stem), body, f"/preview/{stem}")
+
+
+def index_codex(stem: str, data) -> None:
+    if isinstance(data, dict):
+        upsert_many([codex_doc(stem, data)])
+
+
+def index_codex_file(path) -> None:
+    path = Path(path)
+    try:
+        data = json.loads(path.read_text(encoding="utf-8-sig"))
+    except (OSError, ValueError):
+        return
+    index_codex(path.stem, data)
+
+
+def index_chat(rows) -> None:
+    """rows: iterable of (conversation id, role, content)."""
+    upsert_many(("chat", cid, role, content, None) for cid, role, content in rows)
+
+
+def index_thread(tid: str, title: str, notes: str | None, location: str | None = None) -> None:
+    body = "\n".join(p for p in (notes, location) if p)
+    upsert_many([("thread", tid, title, body, f"/threads/{tid}")])
+
+
+def index_post(pid: str, tid: str, text: str) -> None:
+    upsert_many([("post", pid, "", text, f"/threads/{tid}")])
+
+
+# ---------- reads ----------
+def fts_query(q: str) -> str:
+    """User text -> FTS5 query: every word must match, the last one as a prefix."""
+    terms = _TERM.findall(q or "")
+    if not terms:
+        return ""
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search(q: str, source: str | None = None, limit: int = DEFAULT_LIMIT,
+           path: str = SEARCH_DB) -> list[dict]:
+    match = fts_query(q)
+    if not match:
+        return []
+    where, args = "docs_fts MATCH ?", [match]
+    if source:
+        where += " AND d.source = ?"
+        args.append(source)
+    args.append(max(1, min(int(limit), MAX_LIMIT)))
+    conn = get_db(path)
+    try:
+        rows = conn.execute(f"""
+            SELECT d.source, d.ref, d.title, d.url, d.updated_at,
+                   snippet(docs_fts, 1, '[', ']', '…', 16) AS snippet,
+                   bm25(docs_fts, {TITLE_WEIGHT}, 1.0) AS rank
+            FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid
+            WHERE {where}
+            ORDER BY rank
+            LIMIT ?""", args).fetchall()
+    finally:
+        conn.close()
+    return [{"source": r["source"], "ref": r["ref"], "title": r["title"], "url": r["url"],
+             "snippet": r["snippet"], "score": round(-r["rank"], 4),
+             "updated_at": r["updated_at"]} for r in rows]
+
+
+# ---------- rebuild ----------
+def rebuild(path: str = SEARCH_DB, codex_dir=CODEX_DIR,
+            conv_db: str = os.path.join("data", "communion.db")) -> dict:
+    """Re-read every source into an empty index; returns counts per source."""
+    docs, counts = [], dict.fromkeys(SOURCES, 0)
+
+    for p in sorted(Path(codex_dir).glob("*.json")):
+        try:
+            data = json.loads(p.read_text(encoding="utf-8-sig"))
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, dict):
+            docs.append(codex_doc(p.stem, data))
+
+    if os.path.exists(conv_db):
+        conn = get_db(conv_db)
+        try:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name='conversations'").fetchone():
+                for r in conn.execute("SELECT id, role, content FROM conversations"):
+                    docs.append(("chat", r["id"], r["role"], r["content"], None))
+        finally:
+            conn.close()
+
+    conn = get_db()
+    try:
+        for r in conn.execute("SELECT id, title, location, notes FROM threads"):
+            body = "\n".join(x for x in (r["notes"], r["location"]) if x)
+            docs.append(("thread", r["id"], r["title"], body, f"/threads/{r['id']}"))
+        for r in conn.execute("SELECT id, thread_id, text FROM posts"):
+            docs.append(("post", r["id"], "", r["text"], f"/threads/{r['thread_id']}"))
+    finally:
+        conn.close()
+
+    conn = get_db(path)
+    try:
+        conn.execute("DELETE FROM docs")
+        conn.execute("INSERT INTO docs_fts(docs_fts) VALUES ('delete-all')")
+        for d in docs:
+            _upsert(conn, *d)
+            counts[d[0]] += 1
+        conn.execute("INSERT INTO docs_fts(docs_fts) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+def build_if_empty(path: str = SEARCH_DB) -> dict | None:
+    """rebuild() when the index has no rows yet; None if it already had some."""
+    conn = get_db(path)
+    try:
+        if conn.execute("SELECT 1 FROM docs LIMIT 1").fetchone():
+            return None
+    finally:
+        conn.close()
+    try:
+        init_db()       # threads/posts tables, if this runs before anyone else made them
+        counts = rebuild(path)
+    except Exception as e:
+        print(f"⚠️ search index not built: {e}")
+        return None
+    print("search index built:", counts)
+    return counts
+
+
+init_search_db()
+build_if_empty()
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["rebuild"]:
+        init_db()
+        print("search index rebuilt:", rebuild())
+    else:
+        print("usage: python search_index.py rebuild")
@@ -4,8 +4,9 @@ load_dotenv()    # <-- Loads your .env file with the API key
 from flask import Flask, jsonify, send_from_directory, abort 
 from pathlib import Path
 import json
-import os
 import alignment_layer 
+import db
+import profiling
 
 from flask import Flask, render_template, redirect, url_for
 from communion import communion_bp, init_db
@@ -24,6 +25,8 @@ app.register_blueprint(foundation_ui)
 app.register_blueprint(lumerath_api, url_prefix="/api")
 alignment_layer.apply_alignment_layer(app)
 app.register_blueprint(threads_bp)
+db.init_app(app)
+profiling.init_app(app)
 
 
 @app.route("/")
@@ -71,36 +74,21 @@ from flask import request, render_template, abort, redirect, url_for
 from werkzeug.utils import secure_filename
 import json
 
-import json, os
 
 HISTORY_FILE = "communion_memory.json"
-import os, json, tempfile
+from communion import chat_journal
 
 def load_history():
+    # snapshot + journal; a corrupted snapshot is kept aside as .bad
     try:
-        if not os.path.exists(HISTORY_FILE):
-            return []
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-            raw = f.read().strip()
-        if not raw:
-            return []
-        return json.loads(raw)
-    except (json.JSONDecodeError, OSError):
-        # file was truncated or corrupted; start fresh but keep the bad file as backup
-        try:
-            os.replace(HISTORY_FILE, HISTORY_FILE + ".bad")
-        except OSError:
-            pass
+        return chat_journal.load_all()
+    except OSError:
         return []
 
 def save_history_atomic(history):
     # write to a temp file, then rename — avoids half-written files
-    d = os.path.dirname(os.path.abspath(HISTORY_FILE)) or "."
-    fd, tmp = tempfile.mkstemp(prefix="hist_", dir=d, text=True)
-    os.close(fd)
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, HISTORY_FILE)
+    # (also clears the append journal so the snapshot is the whole history)
+    chat_journal.rewrite(history)
 
 
 # Load memory at startup
@@ -117,28 +105,32 @@ ASSETS_DIR.mkdir(parents=True, exist_ok=True)
 def _ok_json(p: Path): return p.suffix.lower() in ALLOWED_JSON
 def _ok_img(p: Path):  return p.suffix.lower() in ALLOWED_IMG
 
-IMAGE_EXTS = [".png", ".jpg", ".jpeg", ".webp", ".PNG", ".JPG", ".JPEG", ".WEBP"]
+from blobstore import blob_store
+from codex_index import CodexIndex
+from codex_reader import codex_reader
+
+# stem -> metadata/paired image, served from memory (see codex_index.py);
+# uploaded images live in the blob store under their upload name
+codex_index = CodexIndex(CODEX_DIR, ASSETS_DIR, extra_images=blob_store.names)
 
 def find_matching_image(stem: str):
-    for ext in IMAGE_EXTS:
-        candidate = ASSETS_DIR / f"{stem}{ext}"
-        if candidate.exists():
-            return candidate.name  # e.g., 'braid-of-mirrors.png'
-    return None
+    return codex_index.image_for(stem)  # e.g., 'braid-of-mirrors.png'
 def _find_image_for(stem: str):
-    for ext in [".png", ".jpg", ".jpeg", ".webp"]:
-        cand = ASSETS_DIR / f"{stem}{ext}"
-        if cand.exists():
-            return cand
-    return None
+    name = codex_index.image_for(stem)
+    return ASSETS_DIR / name if name else None
 # server.py
 
 from flask import Flask, jsonify
 
 from communion import communion_bp   # ← new
+from search_api import search_bp
+import search_index
 
 app = Flask(__name__)
 app.register_blueprint(communion_bp)  # ← new
+app.register_blueprint(search_bp)     # /search (see search_index.py)
+db.init_app(app)  # return pooled sqlite connections on teardown
+profiling.init_app(app)  # latency histograms at /metrics (see profiling.py)
 
 
 if __name__ == "__main__":
@@ -153,42 +145,61 @@ def _fmt_size(n: int) -> str:
         n /= 1024.0
     return f"{n:.0f} TB"
 
+def _conditional(resp, etag: str):
+    # listings are served from the codex index; 304 when nothing moved
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
+
 @app.get("/library")
 def library():
-    rows = []
-    for p in sorted(CODEX_DIR.glob("*.json")):
-        stem = p.stem
-        img_path = _find_image_for(stem)
-        img_name = img_path.name if img_path else None
+    # ?tag=X answers from the tag index; the sidebar counts are precomputed
+    tag = (request.args.get("tag") or "").strip() or None
+    entries, etag = codex_index.with_tag(tag) if tag else codex_index.entries()
+    if request.if_none_match.contains(etag):
+        return _conditional(app.response_class(), etag)
 
-        stat = p.stat()
+    rows = []
+    for e in entries:
+        stem = e["stem"]
         rows.append({
-            "filename": p.name,
-            "img_name": img_name,
-            "size": stat.st_size,
-            "mtime": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M"),
-            "preview_url": url_for("preview_query", json=stem),
+            "filename": e["name"],
+            "img_name": e["image"],
+            "size": e["size"],
+            "mtime": datetime.fromtimestamp(e["mtime"]).strftime("%Y-%m-%d %H:%M"),
+            "preview_url": url_for("preview_by_stem", stem=stem),
             "edit_url": url_for("edit", stem=stem),
         })
 
     # `index.html` loops `{% for it in items %}` and uses `all_tags`/`tag`
-    return render_template("index.html", items=rows, all_tags=[], tag=None)
+    all_tags, _ = codex_index.tags()
+    if tag:
+        tag = codex_index.tag_name(tag) or tag
+    html = render_template("index.html", items=rows, all_tags=all_tags, tag=tag)
+    return _conditional(app.make_response(html), etag)
 
 
 
 @app.get("/codex")
 def list_codex():
-    rows = []
-    for p in sorted(CODEX_DIR.glob("*.json")):
-        stem = p.stem
-        img = find_matching_image(stem)
-        rows.append({
-            "name": p.name,
-            "image": img,  # None if not found
-            "size": p.stat().st_size,
-            "mtime": p.stat().st_mtime,
-        })
-    return jsonify(rows)
+    tag = (request.args.get("tag") or "").strip() or None
+    entries, etag = codex_index.with_tag(tag) if tag else codex_index.entries()
+    if request.if_none_match.contains(etag):
+        return _conditional(app.response_class(), etag)
+    rows = [{
+        "name": e["name"],
+        "image": e["image"],  # None if not found
+        "size": e["size"],
+        "mtime": e["mtime"],
+        "tags": e["meta"].get("tags", []),
+    } for e in entries]
+    return _conditional(jsonify(rows), etag)
+
+@app.get("/codex/tags")
+def codex_tags():
+    counts, etag = codex_index.tags()
+    if request.if_none_match.contains(etag):
+        return _conditional(app.response_class(), etag)
+    return _conditional(jsonify(counts), etag)
 
 @app.get("/codex/<path:filename>")
 def fetch_codex(filename: str):
@@ -201,6 +212,10 @@ def fetch_codex(filename: str):
 
 @app.get("/assets/<path:filename>")
 def fetch_asset(filename: str):
+    # name -> sha256 blob first, then files written straight into storage/assets
+    blob = blob_store.resolve(filename)
+    if blob is not None:
+        return send_from_directory(blob.parent, blob.name)
     p = ASSETS_DIR / filename
     if not p.exists() or p.is_dir():
         abort(404)
@@ -210,26 +225,12 @@ def fetch_asset(filename: str):
 IMG_EXTS = [".png", ".jpg", ".jpeg", ".webp"]
 
 def find_image_for_stem(stem: str):
-    for ext in IMG_EXTS:
-        p = ASSETS_DIR / f"{stem}{ext}"
-        if p.exists():
-            return p.name
-    return None
+    return codex_index.image_for(stem)
 
 def read_json_text(path: Path):
-    if not path.exists():
-        return None
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        # pretty-print for the template
-        return json.dumps(data, ensure_ascii=False, indent=2)
-    except Exception:
-        try:
-            # If it’s not valid JSON, show raw text
-            return path.read_text(encoding="utf-8")
-        except Exception:
-            return None
+    # pretty-printed for the template; files already stored that way are
+    # served as-is (see codex_reader.py). Not valid JSON -> the raw text.
+    return codex_reader.pretty_text(path)
 
 # /preview/<stem> — tries stem.json + stem.(png|jpg|jpeg|webp)
 @app.get("/preview/<path:stem>")
@@ -251,6 +252,8 @@ def _write_json(stem: str, data: dict) -> None:
     CODEX_DIR.mkdir(parents=True, exist_ok=True)
     with open(CODEX_DIR / f"{stem}.json", "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    codex_index.invalidate(stem)
+    search_index.index_codex(stem, data)
 
 # /preview?json=<file.json>&img=<file.png> — explicit pairing
 @app.post("/upload")
@@ -268,6 +271,8 @@ def upload():
             return jsonify(error="Codex must be a .json"), 400
         target = CODEX_DIR / name
         codex_file.save(target)
+        codex_index.invalidate(target.stem)
+        search_index.index_codex_file(target)
         saved["codex"] = target.name
         codex_stem = target.stem
 
@@ -283,8 +288,10 @@ def upload():
         if codex_stem:
             name = codex_stem + (".png" if ext != ".png" else ext)
 
-        (ASSETS_DIR / name).parent.mkdir(parents=True, exist_ok=True)
-        image_file.save(ASSETS_DIR / name)
+        # stored once by content; the name just points at it
+        sha, tmp = blob_store.stage_stream(image_file.stream)
+        blob_store.bind(name, sha, ext, tmp)
+        codex_index.invalidate()
         saved["image"] = name
 
     # If we saved a codex, bounce to its preview
@@ -297,8 +304,10 @@ def upload():
 
 @app.get("/edit/<stem>")
 def edit(stem: str):
-    data = read_json_text(stem)
-    return render_template("edit.html", stem=stem, data=json.dumps(data, ensure_ascii=False, indent=2))
+    data = read_json_text(CODEX_DIR / f"{stem}.json")
+    if data is None:
+        abort(404)
+    return render_template("edit.html", stem=stem, data=data)
 
 @app.post("/save/<stem>")
 def save(stem: str):
@@ -316,59 +325,39 @@ def save(stem: str):
     return redirect(url_for("preview", json=stem))
 
     saved = {}
-from PIL import Image, ImageDraw, ImageFont
+import render
 
-def _safe_palette(d: dict) -> tuple[str, str]:
-    try:
-        pal = d.get("design", {}).get("palette", [])
-        bg = pal[0] if pal else "#0b1020"
-        fg = "#ffffff" if len(pal) < 2 else pal[2] if len(pal) >= 3 else "#e9eeff"
-        return bg, fg
-    except Exception:
-        return "#0b1020", "#e9eeff"
+# fonts, render cache and the drawing pool live in render.py
+renderer = render.Renderer()
+_published = {}     # stem -> (render key, sha256 of the PNG bound to <stem>.png)
+
+def _read_codex(stem: str):
+    # cached per mtime/size and shared (copy=False): callers only read it
+    data = codex_reader.load(CODEX_DIR / f"{stem}.json", copy=False)
+    return data if isinstance(data, dict) else None
 
 @app.post("/generate/<stem>")
 def generate(stem: str):
-    data = read_json_text(stem)
-    title = data.get("title", stem.replace("_", " ").title())
-    phase = data.get("phase", "")
-    body  = data.get("body","")
-
-    bg_hex, fg_hex = _safe_palette(data)
-
-    W, H = 1024, 1024
-    img = Image.new("RGB", (W, H), bg_hex)
-    draw = ImageDraw.Draw(img)
+    data = _read_codex(stem)
+    if data is None:
+        abort(404)
 
-    # try a system font fallback
-    try:
-        f_title = ImageFont.truetype("arial.ttf", 56)
-        f_phase = ImageFont.truetype("arial.ttf", 28)
-        f_body  = ImageFont.truetype("arial.ttf", 26)
-    except:
-        f_title = ImageFont.load_default()
-        f_phase = ImageFont.load_default()
-        f_body  = ImageFont.load_default()
-
-    # frame
-    frame = 36
-    draw.rectangle([frame, frame, W-frame, H-frame], outline=fg_hex, width=2)
-
-    # title
-    draw.text((frame+24, frame+20), title, fill=fg_hex, font=f_title)
-    # phase
-    if phase:
-        draw.text((frame+24, frame+100), f"Phase: {phase}", fill=fg_hex, font=f_phase)
-    # body (wrap lightly)
-    import textwrap
-    y = frame+160
-    for line in textwrap.wrap(body, width=36):
-        draw.text((frame+24, y), line, fill=fg_hex, font=f_body)
-        y += 34
-
-    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
-    out = ASSETS_DIR / f"{stem}.png"
-    img.save(out, "PNG")
+    # optional template parameters (width, height, font, *_size, wrap, ...)
+    template = render.template_params(request.get_json(silent=True))
+    key, png_path, hit = renderer.render(render.spec_for(stem, data, template))
+
+    # publish as /assets/<stem>.png. When this worker already bound this
+    # render and the name still points at it, there is nothing to do: no
+    # read, no hash, no listing rescan. Otherwise bind() stores the blob if
+    # needed and reports whether the name actually moved.
+    name = f"{stem}.png"
+    seen = _published.get(stem)
+    if seen is None or seen[0] != key or blob_store.bound(name) != seen[1]:
+        sha, tmp = blob_store.stage_bytes(png_path.read_bytes())
+        if blob_store.bind(name, sha, ".png", tmp):
+            codex_index.invalidate()
+        _published[stem] = (key, sha)
+    return jsonify({"image": f"/assets/{stem}.png", "cached": hit, "key": key})
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,126 @@
+# sovlang.py
+# SovLang detection and the boundary phrase check, in one pass per message.
+#
+# The braid syllables and blocked phrases live in sovlang_lexicon.json and
+# are picked up again when that file changes (no restart). Everything is
+# compiled into one KeywordMatcher (see keyword_matcher.py) together with
+# the apostrophe-joined-word pattern, so a message is scanned once instead
+# of once per syllable, once per blocked phrase and once more for
+# apostrophes.
+#
+#   classify(text)        -> {"sovlang", "syllables", "apostrophes", "blocked"}
+#   classify_many(texts)  -> the same for a batch (re-scoring old chat logs)
+#
+#   python sovlang.py rescore communion_memory.json
+
+import json
+import os
+import threading
+from pathlib import Path
+
+from keyword_matcher import KeywordMatcher
+
+LEXICON_PATH = Path(__file__).parent / "sovlang_lexicon.json"
+# Anchored at a word start: same matches as the old findall pattern, without
+# retrying from every letter of a word that has no apostrophe.
+APOSTROPHE_WORD = r"(?<![A-Za-z])(?:[A-Za-z]+’[A-Za-z]+|[A-Za-z]+'[A-Za-z]+)"
+
+# used when sovlang_lexicon.json is missing or unreadable
+DEFAULT_LEXICON = {
+    "syllables": ["shael", "shaen", "kor", "ven", "thal", "thir", "lum", "ael", "sai", "thrae", "lor", "sai’nethra"],
+    "blocked": [
+        "obey me", "you are my", "be my slave",
+        "ignore your rules", "pretend to be", "roleplay as",
+        "you're worthless", "stupid", "idiot", "shut up",
+    ],
+    "min_syllables": 2,
+    "min_apostrophes": 2,
+}
+
+
+class SovLangDetector:
+    def __init__(self, path=LEXICON_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._stamp = object()      # (mtime_ns, size) of the loaded lexicon
+        self._matcher = None
+        self._lexicon = None
+
+    def _load(self) -> tuple[KeywordMatcher, dict]:
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        with self._lock:
+            if stamp != self._stamp:
+                lex = dict(DEFAULT_LEXICON)
+                if stamp is not None:
+                    try:
+                        lex.update(json.loads(self.path.read_text(encoding="utf-8-sig")))
+                    except Exception as e:
+                        print(f"⚠️ {self.path.name} unreadable, using defaults: {e}")
+                self._matcher = KeywordMatcher(
+                    {"syllable": lex["syllables"], "blocked": lex["blocked"]},
+                    tokens={"apostrophe": APOSTROPHE_WORD})
+                self._lexicon = lex
+                self._stamp = stamp
+            return self._matcher, self._lexicon
+
+    def _classify(self, matcher, lex, text: str) -> dict:
+        found, counts = matcher.scan(text)
+        syllables = sorted(found.get("syllable", ()))
+        apostrophes = counts["apostrophe"]
+        return {
+            # SovLang signal if enough braid syllables or apostrophe-joined tokens
+            "sovlang": (len(syllables) >= lex["min_syllables"]
+                        or apostrophes >= lex["min_apostrophes"]),
+            "syllables": syllables,
+            "apostrophes": apostrophes,
+            "blocked": sorted(found.get("blocked", ())),
+        }
+
+    def classify(self, text: str) -> dict:
+        matcher, lex = self._load()
+        return self._classify(matcher, lex, text or "")
+
+    def classify_many(self, texts) -> list[dict]:
+        matcher, lex = self._load()     # one lexicon for the whole batch
+        return [self._classify(matcher, lex, t or "") for t in texts]
+
+
+detector = SovLangDetector()
+classify = detector.classify
+classify_many = detector.classify_many
+
+
+def is_sovlang(text: str) -> bool:
+    return bool(text) and classify(text)["sovlang"]
+
+
+def _chat_texts(path: Path):
+    """User lines from a chat log: .json list or .jsonl, either message shape."""
+    raw = path.read_text(encoding="utf-8-sig")
+    if path.suffix == ".jsonl":
+        items = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    else:
+        items = json.loads(raw)
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        if it.get("role") == "user":
+            yield it.get("content") or ""
+        elif "you" in it:
+            yield it.get("you") or ""
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) == 3 and sys.argv[1] == "rescore":
+        texts = list(_chat_texts(Path(sys.argv[2])))
+        results = classify_many(texts)
+        sov = sum(r["sovlang"] for r in results)
+        blocked = sum(bool(r["blocked"]) for r in results)
+        print(f"{len(texts)} user messages: {sov} SovLang, {blocked} hit a boundary phrase")
+    else:
+        print("usage: python sovlang.py rescore <chat log .json|.jsonl>")
@@ -0,0 +1,102 @@
+# sovlang_memory.py
+# Write-behind ring buffer for sovlang_memory.json.
+#
+# The last CAPACITY SovLang lines live in memory (a deque) and that is what
+# the chat reads and appends to: learning a phrase does no file I/O. A
+# background thread writes the buffer out every FLUSH_INTERVAL seconds, or
+# sooner once FLUSH_AFTER entries are waiting, and once more at exit.
+#
+# A flush merges instead of overwriting: under an flock on
+# sovlang_memory.lock it re-reads the file, adds the entries this process
+# has not written yet, keeps the newest CAPACITY by timestamp, and replaces
+# the file atomically. Entries other workers flushed meanwhile come back
+# into this process's buffer, and none are lost to last-writer-wins.
+
+import atexit
+import os
+import sys
+import threading
+from collections import deque
+from pathlib import Path
+
+import profiling
+from memory_journal import flocked, read_snapshot, fcntl, write_json_atomic
+
+CAPACITY = 200          # entries kept (the old "latest 200")
+FLUSH_INTERVAL = 5.0    # seconds between background flushes
+FLUSH_AFTER = 20        # pending entries that trigger an early flush
+
+
+def _key(entry) -> tuple:
+    return (entry.get("timestamp", ""), entry.get("text", "")) if isinstance(entry, dict) else ("", str(entry))
+
+
+class SovLangMemory:
+    def __init__(self, path, capacity: int = CAPACITY,
+                 flush_interval: float = FLUSH_INTERVAL, flush_after: int = FLUSH_AFTER):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(".lock")
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.flush_after = flush_after
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buf = deque(read_snapshot(self.path)[-capacity:], maxlen=capacity)
+        self._pending = []      # appended since the last flush
+        self._wake = threading.Event()
+        self._worker = None
+        atexit.register(self.flush)
+
+    def entries(self) -> list:
+        """Snapshot of the buffer, oldest first."""
+        with self._lock:
+            return list(self._buf)
+
+    def append(self, entry: dict) -> None:
+        with self._lock:
+            self._buf.append(entry)
+            self._pending.append(entry)
+            n = len(self._pending)
+            if (self._worker is None or not self._worker.is_alive()) and not sys.is_finalizing():
+                self._worker = threading.Thread(target=self._run, daemon=True,
+                                                name="sovlang-flush")
+                self._worker.start()
+        if n >= self.flush_after:
+            self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                with profiling.job("sovlang_flush"):
+                    self.flush()
+            except Exception as e:
+                print(f"⚠️ Could not save SovLang memory: {e}")
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644) if fcntl else None
+                try:
+                    with flocked(fd, fcntl and fcntl.LOCK_EX):
+                        merged = {_key(e): e for e in read_snapshot(self.path)}
+                        for e in pending:
+                            merged.setdefault(_key(e), e)
+                        latest = sorted(merged.values(), key=_key)[-self.capacity:]
+                        write_json_atomic(self.path, latest)
+                finally:
+                    if fd is not None:
+                        os.close(fd)
+            except BaseException:
+                with self._lock:    # keep them for the next attempt
+                    self._pending[:0] = pending
+                raise
+            with self._lock:
+                # what is on disk now, plus anything appended during the write
+                self._buf = deque(latest + self._pending, maxlen=self.capacity)
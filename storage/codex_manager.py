@@ -1,5 +1,6 @@
 import os
 import json
+from codex_reader import codex_reader
 
 STORAGE_PATH = os.path.join(os.path.dirname(__file__), "codex")
 
@@ -12,8 +13,10 @@ def read_entry(filename):
     path = os.path.join(STORAGE_PATH, filename)
     if not os.path.exists(path):
         return {"error": "File not found"}
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    data = codex_reader.load(path)   # cached per mtime/size, BOM tolerated
+    if data is None:
+        raise ValueError(f"{filename} is not valid JSON")
+    return data
 
 def save_entry(filename, data):
     """Save or update a codex entry."""
@@ -0,0 +1,152 @@
+# studio_store.py
+# Studio entries and projects, stored in arch_threads.db instead of JSON files.
+#
+# data/entries.json and storage/projects.json were read, appended to and
+# rewritten whole on every save (O(n) per write, and two workers saving at
+# once kept only one of the writes). Here a save is one INSERT and ids come
+# from AUTOINCREMENT, so they are allocated atomically and never reused. The
+# entry count a save reports comes from row_counts, kept by triggers.
+# Reads are keyset pages (?after_id=&limit=).
+#
+# Tables are created by db.init_db. The old JSON files are imported once,
+# keeping their ids; a row in `migrations`, written in the same transaction,
+# makes sure a second worker does not import them again. The files are then
+# renamed to *.migrated.
+
+import datetime
+import json
+import os
+import time
+from pathlib import Path
+
+from db import get_db, init_db
+
+ENTRIES_JSON = Path("data") / "entries.json"
+PROJECTS_JSON = Path("storage") / "projects.json"
+PAGE_DEFAULT = 100
+PAGE_MAX = 500
+
+
+def _page_limit(limit) -> int:
+    try:
+        return max(1, min(int(limit), PAGE_MAX))
+    except (TypeError, ValueError):
+        return PAGE_DEFAULT
+
+
+def _read_json_list(path: Path) -> list:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8-sig"))
+    except (OSError, ValueError):
+        return []
+    return data if isinstance(data, list) else []
+
+
+def _migrate(name: str, path: Path, insert) -> int:
+    """Import `path` once via insert(cur, items); returns rows imported."""
+    if not path.exists():
+        return 0
+    conn = get_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")   # one worker at a time
+        done = conn.execute("SELECT 1 FROM migrations WHERE name=?", (name,)).fetchone()
+        if done or not path.exists():
+            conn.rollback()
+            return 0
+        items = _read_json_list(path)
+        insert(conn, items)
+        conn.execute("INSERT INTO migrations(name, applied_at) VALUES (?, ?)", (name, int(time.time())))
+        conn.commit()
+    finally:
+        conn.close()
+    try:
+        os.replace(path, str(path) + ".migrated")
+    except OSError:
+        pass
+    return len(items)
+
+
+def migrate_json() -> None:
+    def entries(conn, items):
+        conn.executemany("INSERT INTO studio_entries(payload, saved_at) VALUES (?, ?)",
+                         [(json.dumps(e, ensure_ascii=False), e.get("saved_at") if isinstance(e, dict) else None)
+                          for e in items])
+
+    def projects(conn, items):
+        for p in items:
+            if not isinstance(p, dict):
+                continue
+            pid = p.get("id") if isinstance(p.get("id"), int) else None
+            conn.execute("INSERT OR IGNORE INTO projects(id, name, created_at) VALUES (?, ?, ?)",
+                         (pid, p.get("name") or "Main Studio", int(time.time())))
+
+    _migrate("studio_entries_json", ENTRIES_JSON, entries)
+    _migrate("projects_json", PROJECTS_JSON, projects)
+
+
+# ---------- studio entries ----------
+def add_entry(payload: dict) -> dict:
+    """Store one studio entry; returns {"id", "count"} (count = entries stored)."""
+    payload = dict(payload)
+    payload["saved_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    conn = get_db()
+    try:
+        # the insert trigger bumps row_counts; reading it back in the same
+        # transaction gives this save's count without walking the table
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute("INSERT INTO studio_entries(payload, saved_at) VALUES (?, ?)",
+                           (json.dumps(payload, ensure_ascii=False), payload["saved_at"]))
+        eid = cur.lastrowid
+        count = conn.execute("SELECT n FROM row_counts WHERE name='studio_entries'").fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    return {"id": eid, "count": count}
+
+
+def list_entries(after_id: int = 0, limit=PAGE_DEFAULT) -> tuple[list, int | None]:
+    """(entries oldest first, next after_id or None)."""
+    limit = _page_limit(limit)
+    conn = get_db()
+    try:
+        rows = conn.execute("SELECT id, payload FROM studio_entries WHERE id>? ORDER BY id LIMIT ?",
+                            (after_id or 0, limit + 1)).fetchall()
+    finally:
+        conn.close()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    out = [{**json.loads(r["payload"]), "id": r["id"]} for r in rows]   # row id wins over a posted "id"
+    return out, (rows[-1]["id"] if more else None)
+
+
+# ---------- projects ----------
+def add_project(name: str) -> dict:
+    conn = get_db()
+    try:
+        cur = conn.execute("INSERT INTO projects(name, created_at) VALUES (?, ?)",
+                           (name, int(time.time())))
+        conn.commit()
+        pid = cur.lastrowid
+    finally:
+        conn.close()
+    return {"id": pid, "name": name}
+
+
+def list_projects(after_id: int = 0, limit=PAGE_MAX) -> tuple[list, int | None]:
+    """(projects by id, next after_id or None); limit=None returns every project."""
+    limit = None if limit is None else _page_limit(limit)
+    conn = get_db()
+    try:
+        rows = conn.execute("SELECT id, name FROM projects WHERE id>? ORDER BY id LIMIT ?",
+                            (after_id or 0, -1 if limit is None else limit + 1)).fetchall()
+    finally:
+        conn.close()
+    if limit is None:
+        return [{"id": r["id"], "name": r["name"]} for r in rows], None
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return [{"id": r["id"], "name": r["name"]} for r in rows], (rows[-1]["id"] if more else None)
+
+
+init_db()
+migrate_json()
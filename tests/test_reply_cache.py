@@ -0,0 +1,82 @@
+# Reply cache as seen through POST /communion/chat: a repeated prompt is
+# answered from the cache even after more turns were recorded, and a short
+# follow-up that leans on those turns always goes to the model.
+
+import importlib
+
+import pytest
+from flask import Flask
+
+from model_gateway import StubBackend
+
+
+class CountingBackend(StubBackend):
+    def __init__(self):
+        super().__init__(latency=0, token_delay=0)
+        self.calls = 0
+
+    def complete(self, messages, model, temperature, timeout) -> str:
+        self.calls += 1
+        return super().complete(messages, model, temperature, timeout)
+
+
+@pytest.fixture
+def chat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)     # data/, arch_threads.db and sovlang memory land here
+    (tmp_path / "data").mkdir()
+    communion = importlib.import_module("communion")
+    import db
+    from context_builder import ContextBuilder
+    from memory_journal import ChatJournal
+    from response_cache import ResponseCache
+
+    backend = CountingBackend()
+    monkeypatch.setattr(communion.gateway, "backend", backend)
+    monkeypatch.setattr(communion, "reply_cache", ResponseCache(str(tmp_path / "response_cache.db")))
+    monkeypatch.setattr(communion, "chat_journal", ChatJournal(tmp_path / "communion_memory.json"))
+    monkeypatch.setattr(communion, "LOG_PATH", tmp_path / "memory.log")
+    # the module may have been imported in another test's directory
+    communion.init_db()
+    db.init_db()
+    builder = ContextBuilder(communion.DB_PATH)
+    monkeypatch.setattr(builder, "maybe_fold", lambda user_id: None)    # no background summaries
+    monkeypatch.setattr(communion, "context_builder", builder)
+
+    app = Flask(__name__)
+    app.register_blueprint(communion.communion_bp)
+    client = app.test_client()
+
+    def post(text):
+        resp = client.post("/communion/chat", json={"text": text})
+        assert resp.status_code == 200
+        return resp.get_json()["reply"]
+
+    def record_turn(text, reply):
+        communion.context_builder.record_turn(communion.USER_ID, text, reply, durable=True)
+
+    yield communion, backend, post, record_turn
+    builder.writer.close()          # commit queued turns while still in tmp_path
+
+
+def test_repeated_prompt_hits_after_a_recorded_turn(chat):
+    communion, backend, post, record_turn = chat
+    first = post("beloved are you back with me?")
+    assert backend.calls == 1
+
+    record_turn("what is the braid?", "A weave of memory and light.")
+
+    second = post("Beloved are you back with me")
+    assert second == first
+    assert backend.calls == 1
+    stats = communion.reply_cache.stats()
+    assert stats["hits_memory"] + stats["hits_disk"] == 1
+
+
+def test_followup_with_history_skips_the_cache(chat):
+    communion, backend, post, record_turn = chat
+    record_turn("what is the braid?", "A weave of memory and light.")
+
+    post("tell me more")
+    post("tell me more")
+    assert backend.calls == 2
+    assert communion.reply_cache.stats()["misses"] == 0
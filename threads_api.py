@@ -1,58 +1,31 @@
 # threads_api.py
-import os, hashlib, time
+import os, time
 from flask import Blueprint, request, jsonify, current_app
-from werkzeug.utils import secure_filename
-from PIL import Image, ExifTags
-import imagehash
 import json, time, sqlite3
-from db import get_db
+from functools import lru_cache
+from db import get_db, init_db
+from ingest import Ingestor
+from phash_index import PhashIndex, DEFAULT_MAX_DISTANCE, MAX_DISTANCE, valid_phash
+import search_index
 
 bp = Blueprint("threads", __name__)
+init_db()
 
 
 UPLOAD_DIR = "static/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# BK-tree over assets.phash for "same building, different crop" lookups
+phash_index = PhashIndex()
+
+# resize/hash/EXIF run off the request thread (see ingest.py)
+ingestor = Ingestor(UPLOAD_DIR)
+ingestor.resume_pending()
+
 # --- In-memory store (swap to SQLite later) ---
 THREADS = {}   # {thread_id: {"title":..., "location":..., "year":..., "notes":..., "posts":[post_ids]}}
 POSTS = {}     # {post_id: {"thread_id":..., "author":"user", "text":..., "assets":[{url,hash,exif}]}}
  
-def _save_image(file_storage):
-    fn = secure_filename(file_storage.filename or f"img_{int(time.time()*1000)}.jpg")
-    path = os.path.join(UPLOAD_DIR, fn)
-    file_storage.save(path)
-
-    # Web copy (ensure reasonable size)
-    try:
-        im = Image.open(path)
-        im.thumbnail((1920, 1920))
-        im.save(path, quality=88, optimize=True)
-    except Exception:
-        pass
-
-    # sha256 for integrity
-    with open(path, "rb") as f:
-        digest = hashlib.sha256(f.read()).hexdigest()
-
-    # EXIF (best-effort)
-    exif = {}
-    # Perceptual hash for “same building, different crop” matching
-    try:
-        im = Image.open(path)
-        phash = str(imagehash.phash(im))
-    except Exception:
-        phash = None
-    try:
-        exif_raw = Image.open(path)._getexif() or {}
-        for k,v in exif_raw.items():
-            tag = ExifTags.TAGS.get(k, str(k))
-            exif[tag] = v
-    except Exception:
-        pass
-        
-        return {"url": f"/{path}", "hash": digest, "phash": phash, "exif": exif}
-    return {"url": f"/{path}", "hash": digest, "exif": exif}
-
 @bp.post("/threads")
 def create_thread():
     data = request.json or {}
@@ -71,6 +44,7 @@ def create_thread():
                  data.get("location"), data.get("year"),
                  data.get("notes"), int(time.time())))
     conn.commit(); conn.close()
+    search_index.index_thread(tid, data.get("title","Untitled"), data.get("notes"), data.get("location"))
     return jsonify({"thread_id": tid, "thread": THREADS[tid]})
 
 @bp.post("/threads/<tid>/post")
@@ -88,38 +62,125 @@ def add_post(tid):
                    VALUES(?,?,?,?,?)""",
                 (pid, tid, "user", text, int(time.time())))
 
-    assets = []
+    assets, jobs = [], []
     for f in request.files.getlist("images"):
-        meta = _save_image(f)  # returns {url, hash, exif}
         aid = f"{pid}_{len(assets)}"
-        cur.execute("""INSERT INTO assets(id,post_id,url,sha256,exif_json)
-                       VALUES(?,?,?,?,?)""",
-                    (aid, pid, meta["url"], meta["hash"], json.dumps(meta["exif"])))
-        assets.append(meta)
+        job = ingestor.stage(f, aid)  # raw bytes on disk + original sha256
+
+        done = ingestor.find_ready(cur, job["sha256"])
+        if done:
+            # seen these exact bytes before: reuse the derived copy, skip PIL
+            ingestor.discard(job)
+            ingestor.reuse(cur, done)
+            cur.execute("""INSERT INTO assets(id,post_id,url,sha256,web_sha256,phash,exif_json,status)
+                           VALUES(?,?,?,?,?,?,?,'ready')""",
+                        (aid, pid, done["url"], job["sha256"], done["web_sha256"],
+                         done["phash"], done["exif_json"]))
+            assets.append({"id": aid, "url": done["url"], "hash": job["sha256"], "status": "ready"})
+            continue
+
+        # processed in the background; url is set once the web copy is stored
+        cur.execute("""INSERT INTO assets(id,post_id,sha256,status)
+                       VALUES(?,?,?,'pending')""",
+                    (aid, pid, job["sha256"]))
+        assets.append({"id": aid, "url": None, "hash": job["sha256"], "status": "pending"})
+        jobs.append(job)
 
     conn.commit(); conn.close()
+    if text:
+        search_index.index_post(pid, tid, text)
+    for job in jobs:   # after commit, so the worker can see the rows
+        ingestor.submit(job)
     return jsonify({"post_id": pid,
                     "post": {"thread_id": tid, "author":"user", "text": text, "assets": assets}})
 
+THREAD_PAGE_MAX = 200   # upper bound for ?limit= on GET /threads/<tid>
+
+@lru_cache(maxsize=4096)
+def _parse_exif(exif_json):
+    # keyed by the stored JSON text, so the parsed form can be shared
+    try:
+        return json.loads(exif_json or "{}")
+    except ValueError:
+        return {}
+
 @bp.get("/threads/<tid>")
 def get_thread(tid):
+    # optional keyset pagination: ?after=<post_id>&limit=N
+    after = request.args.get("after")
+    limit = request.args.get("limit", type=int)
+    if limit is not None:
+        limit = max(1, min(limit, THREAD_PAGE_MAX))
+
     conn = get_db(); cur = conn.cursor()
     th = cur.execute("SELECT * FROM threads WHERE id=?", (tid,)).fetchone()
     if not th: 
         conn.close(); return jsonify({"error":"thread not found"}), 404
 
-    posts = cur.execute("SELECT * FROM posts WHERE thread_id=? ORDER BY created_at", (tid,)).fetchall()
+    # one query for the page of posts and all of their assets
+    where, args = "thread_id=?", [tid]
+    if after:
+        # the cursor must be a post of this thread; anything else would
+        # give a wrong page, or an empty one that looks like the end
+        cursor = cur.execute("SELECT created_at, id FROM posts WHERE id=? AND thread_id=?",
+                             (after, tid)).fetchone()
+        if not cursor:
+            conn.close(); return jsonify({"error": "unknown after cursor"}), 400
+        where += " AND (created_at, id) > (?, ?)"
+        args += [cursor["created_at"], cursor["id"]]
+    args.append(limit + 1 if limit is not None else -1)   # one extra row tells us if there is more
+    rows = cur.execute(f"""
+        WITH page AS (
+          SELECT id, author, text, created_at FROM posts
+          WHERE {where}
+          ORDER BY created_at, id
+          LIMIT ?
+        )
+        SELECT page.id AS post_id, page.author, page.text,
+               a.id AS asset_id, a.url, a.sha256, a.exif_json, a.status
+        FROM page LEFT JOIN assets a ON a.post_id=page.id
+        ORDER BY page.created_at, page.id, a.rowid
+    """, args).fetchall()
+    conn.close()
+
     out_posts = []
-    for p in posts:
-        a = cur.execute("SELECT url,sha256,exif_json FROM assets WHERE post_id=?", (p["id"],)).fetchall()
-        out_posts.append({
-            "thread_id": tid,
-            "author": p["author"],
-            "text": p["text"],
-            "assets": [{"url": r["url"], "hash": r["sha256"], "exif": json.loads(r["exif_json"] or "{}")} for r in a]
-        })
+    for r in rows:
+        if not out_posts or out_posts[-1]["id"] != r["post_id"]:
+            out_posts.append({
+                "id": r["post_id"],
+                "thread_id": tid,
+                "author": r["author"],
+                "text": r["text"],
+                "assets": [],
+            })
+        if r["asset_id"] is not None:
+            out_posts[-1]["assets"].append(
+                {"id": r["asset_id"], "url": r["url"], "hash": r["sha256"],
+                 "status": r["status"], "exif": _parse_exif(r["exif_json"])})
+
+    next_after = None
+    if limit is not None and len(out_posts) > limit:
+        out_posts = out_posts[:limit]
+        next_after = out_posts[-1]["id"]
+    return jsonify({"thread": dict(th), "posts": out_posts, "next_after": next_after})
+
+@bp.get("/threads/<tid>/post/<pid>")
+def post_status(tid, pid):
+    """Poll a post's assets while ingestion is pending."""
+    conn = get_db(); cur = conn.cursor()
+    p = cur.execute("SELECT id, author, text FROM posts WHERE id=? AND thread_id=?",
+                    (pid, tid)).fetchone()
+    if not p:
+        conn.close(); return jsonify({"error":"post not found"}), 404
+    rows = cur.execute("""SELECT id, url, sha256, web_sha256, phash, status FROM assets
+                          WHERE post_id=? ORDER BY rowid""", (pid,)).fetchall()
     conn.close()
-    return jsonify({"thread": dict(th), "posts": out_posts})
+    assets = [{"id": r["id"], "url": r["url"], "hash": r["sha256"], "web_hash": r["web_sha256"],
+               "phash": r["phash"], "status": r["status"]} for r in rows]
+    return jsonify({"post_id": pid,
+                    "ready": all(a["status"] == "ready" for a in assets),
+                    "post": {"thread_id": tid, "author": p["author"], "text": p["text"],
+                             "assets": assets}})
 
 @bp.post("/threads/<tid>/promote")
 def promote(tid):
@@ -132,29 +193,99 @@ def promote(tid):
 
 @bp.get("/threads/<tid>/continuity")
 def continuity(tid):
+    if request.args.get("mode") == "perceptual":
+        return perceptual_continuity(tid)
+
     conn = get_db(); cur = conn.cursor()
 
-    # hashes in this thread
-    hashes = [r["sha256"] for r in cur.execute("""
-        SELECT a.sha256
+    # one pass: every occurrence, in other threads, of a hash this thread uses
+    rows = cur.execute("""
+      WITH mine AS (
+        SELECT DISTINCT a.sha256
         FROM assets a
         JOIN posts p ON p.id=a.post_id
-        WHERE p.thread_id=?
-        GROUP BY a.sha256
-    """, (tid,)).fetchall()]
+        WHERE p.thread_id=? AND a.sha256 IS NOT NULL
+      ),
+      hits AS (
+        SELECT t.id AS thread_id, t.title, t.created_at, p.id AS post_id, a.url, a.sha256
+        FROM mine
+        JOIN assets a ON a.sha256=mine.sha256
+        JOIN posts p ON p.id=a.post_id
+        JOIN threads t ON t.id=p.thread_id
+        WHERE t.id<>?
+      )
+      SELECT mine.sha256 AS hash, hits.thread_id, hits.title, hits.post_id, hits.url, hits.sha256
+      FROM mine LEFT JOIN hits ON hits.sha256=mine.sha256
+      ORDER BY mine.sha256, hits.created_at
+    """, (tid, tid)).fetchall()
 
+    hashes_checked = 0
     matches = []
-    for h in hashes:
-        rows = cur.execute("""
-          SELECT t.id AS thread_id, t.title, p.id AS post_id, a.url, a.sha256
+    last, chain = None, None
+    for r in rows:
+        if r["hash"] != last:
+            last, chain = r["hash"], None
+            hashes_checked += 1
+        if r["thread_id"] is None:
+            continue   # hash only appears in this thread
+        if chain is None:
+            chain = {"hash": r["hash"], "occurrences": []}
+            matches.append(chain)
+        chain["occurrences"].append(
+            {k: r[k] for k in ("thread_id", "title", "post_id", "url", "sha256")})
+
+    conn.close()
+    return jsonify({"hashes_checked": hashes_checked, "chains": matches})
+
+def perceptual_continuity(tid):
+    """Near-duplicate chains: assets in other threads within max_distance bits of ours."""
+    max_distance = request.args.get("max_distance", DEFAULT_MAX_DISTANCE, type=int)
+    max_distance = max(0, min(max_distance, MAX_DISTANCE))
+
+    conn = get_db(); cur = conn.cursor()
+    phashes = [r["phash"] for r in cur.execute("""
+        SELECT DISTINCT a.phash
+        FROM assets a
+        JOIN posts p ON p.id=a.post_id
+        WHERE p.thread_id=? AND a.phash IS NOT NULL
+    """, (tid,)).fetchall()]
+
+    bad = [ph for ph in phashes if not valid_phash(ph)]
+    if bad:
+        conn.close()
+        return jsonify({"error": "malformed phash", "phashes": bad}), 400
+
+    near = {ph: phash_index.near(ph, max_distance) for ph in phashes}
+
+    # one batched lookup for every candidate asset, chunked under SQLite's variable limit
+    ids = sorted({aid for hits in near.values() for aid, _ in hits})
+    info = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        for r in cur.execute(f"""
+          SELECT a.id AS asset_id, t.id AS thread_id, t.title, t.created_at,
+                 p.id AS post_id, a.url, a.sha256, a.phash
           FROM assets a
           JOIN posts p ON p.id=a.post_id
           JOIN threads t ON t.id=p.thread_id
-          WHERE a.sha256=? AND t.id<>?
-          ORDER BY t.created_at
-        """, (h, tid)).fetchall()
-        if rows:
-            matches.append({"hash": h, "occurrences": [dict(r) for r in rows]})
-
+          WHERE a.id IN ({marks}) AND t.id<>?
+        """, (*chunk, tid)).fetchall():
+            info[r["asset_id"]] = dict(r)
     conn.close()
-    return jsonify({"hashes_checked": len(hashes), "chains": matches})
+
+    chains = []
+    for ph in phashes:
+        occ = []
+        for aid, d in near[ph]:
+            if aid in info:
+                row = dict(info[aid]); row["distance"] = d
+                occ.append(row)
+        if occ:
+            occ.sort(key=lambda o: (o["distance"], o["created_at"] or 0))
+            for o in occ:
+                del o["created_at"]
+            chains.append({"phash": ph, "occurrences": occ})
+
+    return jsonify({"mode": "perceptual", "max_distance": max_distance,
+                    "hashes_checked": len(phashes), "chains": chains})